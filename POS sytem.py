@@ -1,18 +1,32 @@
 # backend/app.py
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g, has_request_context, stream_with_context, abort
 from flask_sqlalchemy import SQLAlchemy
-# Conditional SocketIO import: on Vercel we use a no-op fallback
+from flask_sqlalchemy.session import Session as FlaskSession
+from werkzeug.routing import UUIDConverter
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge, UnsupportedMediaType
+# Conditional SocketIO import: on Vercel we use a no-op fallback. qrcode/PIL and the
+# PostgreSQL JSONB type are imported on first use to keep serverless cold starts short.
 from datetime import datetime, timedelta
 import json
 import hashlib
-import qrcode
 import base64
+import copy
+import functools
+import gzip
+import importlib
 import io
 import uuid
+import random
 import threading
 import time
-from sqlalchemy import func, and_
-from sqlalchemy.dialects.postgresql import JSONB
+import select
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sqlalchemy import func, and_, or_, event, case, column, update, values
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import selectinload
+from sqlalchemy.pool import NullPool, QueuePool
 import os
 from dotenv import load_dotenv
 import logging
@@ -28,9 +42,157 @@ if database_url and database_url.startswith("postgres://"):
 
 app = Flask(__name__, static_folder=None)
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+# Optional read replica for read-only endpoints, see ReplicaRouter
+replica_url = os.getenv('DATABASE_REPLICA_URL', '')
+if replica_url.startswith("postgres://"):
+    replica_url = replica_url.replace("postgres://", "postgresql://", 1)
+app.config['DATABASE_REPLICA_URL'] = replica_url
+# Replica routing: lag beyond which reads go to the primary, seconds between lag checks,
+# and how long a client keeps reading from the primary after it wrote
+app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+app.config['REPLICA_LAG_CHECK_SECONDS'] = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '2'))
+app.config['REPLICA_STICKY_SECONDS'] = float(os.getenv('REPLICA_STICKY_SECONDS', '10'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
+class UUIDStringConverter(UUIDConverter):
+    """<uuid:...> URL segments as canonical strings, malformed ids 404 before any query"""
+    def to_python(self, value):
+        return str(super().to_python(value))
+
+app.url_map.converters['uuid'] = UUIDStringConverter
+# Sync engine tuning: rows claimed per transaction and parallel drain workers
+app.config['SYNC_BATCH_SIZE'] = int(os.getenv('SYNC_BATCH_SIZE', '200'))
+app.config['SYNC_CONCURRENCY'] = int(os.getenv('SYNC_CONCURRENCY', '4'))
+# Failed sync items: due retries claimed per batch, backoff bounds, attempts before dead-lettering
+app.config['SYNC_RETRY_BATCH_SIZE'] = int(os.getenv('SYNC_RETRY_BATCH_SIZE', '20'))
+app.config['SYNC_RETRY_BASE_SECONDS'] = float(os.getenv('SYNC_RETRY_BASE_SECONDS', '30'))
+app.config['SYNC_RETRY_MAX_SECONDS'] = float(os.getenv('SYNC_RETRY_MAX_SECONDS', '3600'))
+app.config['SYNC_MAX_RETRIES'] = int(os.getenv('SYNC_MAX_RETRIES', '8'))
+# sync_queue retention: age of completed rows, rows deleted per transaction, pause between
+# batches, seconds between runs, and an optional directory for gzip NDJSON archives
+app.config['SYNC_RETENTION_DAYS'] = float(os.getenv('SYNC_RETENTION_DAYS', '7'))
+app.config['SYNC_RETENTION_BATCH_SIZE'] = int(os.getenv('SYNC_RETENTION_BATCH_SIZE', '500'))
+app.config['SYNC_RETENTION_PAUSE_MS'] = int(os.getenv('SYNC_RETENTION_PAUSE_MS', '50'))
+app.config['SYNC_RETENTION_INTERVAL'] = int(os.getenv('SYNC_RETENTION_INTERVAL', '3600'))
+app.config['SYNC_ARCHIVE_DIR'] = os.getenv('SYNC_ARCHIVE_DIR', '')
+# Background leader election: seconds between a follower's attempts to take over, and the
+# lock file used where PostgreSQL advisory locks are unavailable
+app.config['BACKGROUND_LEADER_RETRY_SECONDS'] = float(os.getenv('BACKGROUND_LEADER_RETRY_SECONDS', '15'))
+app.config['BACKGROUND_LOCK_FILE'] = os.getenv('BACKGROUND_LOCK_FILE', os.path.join(
+    tempfile.gettempdir(), f"pos-background-{hashlib.sha256(database_url.encode()).hexdigest()[:12]}.lock"))
+# Background drain safety-net polling, backing off from min to max seconds while idle
+app.config['SYNC_POLL_MIN_SECONDS'] = float(os.getenv('SYNC_POLL_MIN_SECONDS', '5'))
+app.config['SYNC_POLL_MAX_SECONDS'] = float(os.getenv('SYNC_POLL_MAX_SECONDS', '120'))
+# QR rendering: worker processes (0 renders lazily on first request) and max queued renders
+app.config['QR_RENDER_WORKERS'] = int(os.getenv('QR_RENDER_WORKERS', '0' if os.environ.get('VERCEL') else '2'))
+app.config['QR_RENDER_QUEUE'] = int(os.getenv('QR_RENDER_QUEUE', '64'))
+app.config['QR_CACHE_BYTES'] = int(os.getenv('QR_CACHE_BYTES', str(32 * 1024 * 1024)))
+app.config['CATALOG_CACHE_VIEWS'] = int(os.getenv('CATALOG_CACHE_VIEWS', '256'))
+# Delta sync page bounds for /api/sync/pull
+app.config['SYNC_PULL_PAGE_ROWS'] = int(os.getenv('SYNC_PULL_PAGE_ROWS', '500'))
+app.config['SYNC_PULL_PAGE_BYTES'] = int(os.getenv('SYNC_PULL_PAGE_BYTES', str(512 * 1024)))
+# Change feed for serverless tills: longest long-poll wait (Vercel functions time out),
+# how often a waiter re-reads the change log head, and how long one event stream stays open.
+# Event streams are sent in pieces only where the runtime streams responses (not Vercel).
+app.config['SYNC_WATCH_TIMEOUT_SECONDS'] = float(os.getenv('SYNC_WATCH_TIMEOUT_SECONDS', '8' if os.environ.get('VERCEL') else '25'))
+app.config['SYNC_WATCH_POLL_MS'] = int(os.getenv('SYNC_WATCH_POLL_MS', '1000'))
+app.config['SYNC_EVENTS_STREAM_SECONDS'] = float(os.getenv('SYNC_EVENTS_STREAM_SECONDS', '300'))
+app.config['SYNC_EVENTS_STREAMING'] = os.getenv('SYNC_EVENTS_STREAMING', 'false' if os.environ.get('VERCEL') else 'true').lower() == 'true'
+# Sync wire format: decompressed body limit, smallest response worth compressing,
+# and records queued per insert when a push is streamed
+app.config['SYNC_MAX_BODY_BYTES'] = int(os.getenv('SYNC_MAX_BODY_BYTES', str(64 * 1024 * 1024)))
+app.config['SYNC_COMPRESS_MIN_BYTES'] = int(os.getenv('SYNC_COMPRESS_MIN_BYTES', '1024'))
+app.config['SYNC_STREAM_CHUNK'] = int(os.getenv('SYNC_STREAM_CHUNK', '500'))
+# Device presence: seconds between batched heartbeat writes, and silence before a device is offline
+app.config['DEVICE_HEARTBEAT_FLUSH_SECONDS'] = float(os.getenv('DEVICE_HEARTBEAT_FLUSH_SECONDS', '5'))
+app.config['DEVICE_OFFLINE_AFTER_SECONDS'] = float(os.getenv('DEVICE_OFFLINE_AFTER_SECONDS', '90'))
+# Per-device pending counters behind /api/sync/status: a Redis shared by all workers
+# (unset keeps the counters in process) and seconds between recounts from sync_queue
+app.config['SYNC_COUNTERS_REDIS_URL'] = os.getenv('SYNC_COUNTERS_REDIS_URL', os.getenv('REDIS_URL', ''))
+app.config['SYNC_COUNTER_RECONCILE_SECONDS'] = float(os.getenv('SYNC_COUNTER_RECONCILE_SECONDS', '300'))
+# Seconds a dashboard stats payload is reused before re-reading the rollups
+app.config['DASHBOARD_CACHE_TTL'] = float(os.getenv('DASHBOARD_CACHE_TTL', '5'))
+# Report per-request SQL query counts in an X-Query-Count response header
+app.config['QUERY_COUNT_HEADER'] = os.getenv('QUERY_COUNT_HEADER', 'false').lower() == 'true'
+
+# Realtime: a message queue (e.g. the Redis from docker-compose) lets several
+# workers share websocket clients; without one, events stay in this process
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.getenv('SOCKETIO_MESSAGE_QUEUE', os.getenv('REDIS_URL', ''))
+app.config['SOCKETIO_ASYNC_MODE'] = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+# Window in which repeated events for the same key collapse into the latest one
+app.config['REALTIME_COALESCE_MS'] = int(os.getenv('REALTIME_COALESCE_MS', '250'))
+
+# Database pooling profile: serverless (Vercel), threaded (gunicorn sync/gthread workers,
+# dev server) or eventlet (eventlet and gevent green-thread workers)
+def default_pool_profile():
+    if os.environ.get('VERCEL'):
+        return 'serverless'
+    if app.config['SOCKETIO_ASYNC_MODE'] in ('eventlet', 'gevent'):
+        return 'eventlet'
+    return 'threaded'
+
+app.config['DB_POOL_PROFILE'] = os.getenv('DB_POOL_PROFILE', default_pool_profile())
+
+class _CheckoutTimer:
+    """Times how long a caller waits for a pooled connection"""
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            DB_POOL_CHECKOUT_ERRORS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+class TimedQueuePool(_CheckoutTimer, QueuePool):
+    pass
+
+class TimedNullPool(_CheckoutTimer, NullPool):
+    pass
+
+def pool_engine_options(profile, url):
+    """Engine options for a pooling profile"""
+    if url.startswith('sqlite') and (url in ('sqlite://', 'sqlite:///') or ':memory:' in url):
+        # In-memory SQLite must keep its single shared connection
+        return {}
+    
+    if profile == 'serverless':
+        # Each function instance may be frozen or discarded at any time, so hold no idle
+        # connections and let an external pooler (PgBouncer, Supavisor, RDS Proxy) share them.
+        # No pre-ping: every checkout is a fresh connection, the ping would only add a round trip
+        options = {'poolclass': TimedNullPool}
+        if url.startswith('postgresql'):
+            options['connect_args'] = {'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5'))}
+        return options
+    
+    if profile == 'eventlet':
+        # Many green threads share few connections: a larger pool, a short timeout so
+        # overload fails fast, and LIFO so idle connections beyond the working set can expire
+        defaults = {'size': '20', 'overflow': '20', 'timeout': '10'}
+        use_lifo = True
+    elif profile == 'threaded':
+        # Enough for the request threads plus the sync drain workers
+        defaults = {'size': str(max(10, app.config['SYNC_CONCURRENCY'] + 4)), 'overflow': '20', 'timeout': '30'}
+        use_lifo = False
+    else:
+        raise ValueError(f"Unknown DB_POOL_PROFILE: {profile}")
+    
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', defaults['size'])),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', defaults['overflow'])),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', defaults['timeout'])),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': True,
+        'pool_use_lifo': use_lifo,
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_engine_options(app.config['DB_POOL_PROFILE'], database_url)
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': replica_url, **pool_engine_options(app.config['DB_POOL_PROFILE'], replica_url)}}
+
 # Configure SocketIO: use a dummy implementation on Vercel (serverless)
 if os.environ.get('VERCEL'):
     class _DummySocketIO:
@@ -43,14 +205,203 @@ if os.environ.get('VERCEL'):
     socketio = _DummySocketIO()
     def emit(*args, **kwargs):
         return None
+    def join_room(*args, **kwargs):
+        return None
 else:
-    from flask_socketio import SocketIO, emit
-    async_mode = 'threading'
-    socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode)
+    from flask_socketio import SocketIO, emit, join_room
+    async_mode = app.config['SOCKETIO_ASYNC_MODE']
+    message_queue = app.config['SOCKETIO_MESSAGE_QUEUE']
+    if message_queue and not message_queue.startswith('memory://'):
+        socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode,
+                            message_queue=message_queue, channel='pos-socketio')
+    else:
+        socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode)
+
+class RoutingSession(FlaskSession):
+    """Sends queries to the replica bind while a read_replica view has opted in.
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary."""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('read_replica') and not self._flushing
+                and not (clause is not None and getattr(clause, 'is_dml', False))):
+            if self.info['read_replica'] == 'pending':
+                # Decided at the first read, once the view has parsed its body
+                self.info['read_replica'] = choose_read_source()
+            if self.info['read_replica'] == 'replica':
+                return self._db.engines['replica']
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+# Native UUID on PostgreSQL, CHAR(32) elsewhere; values stay canonical strings in Python
+UUIDType = db.Uuid(as_uuid=False)
+
+def new_id():
+    """Time-ordered UUIDv7 string: 48-bit unix ms, then random bits (RFC 9562).
+    Keys generated close together land on the same B-tree pages, so inserts append."""
+    millis = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), 'big')
+    value = (millis & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | (rand >> 68) << 64 | 0b10 << 62 | (rand & ((1 << 62) - 1))
+    return str(uuid.UUID(int=value))
+
+def canonical_uuid(value):
+    """Lower-case dashed form of a UUID string, None if value is not a UUID"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except (TypeError, ValueError):
+        return None
 
-db = SQLAlchemy(app)
+class JSONType(db.TypeDecorator):
+    """JSONB on PostgreSQL, plain JSON elsewhere (SQLite for local runs and benchmarks)"""
+    impl = db.JSON
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import JSONB
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(db.JSON())
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+logger.info(f"Database pool profile: {app.config['DB_POOL_PROFILE']}")
+
+# Metrics (Prometheus text format, values are per process)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}  # labels -> [per-bucket counts..., sum, count]
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, entry in sorted(self._values.items()):
+                for index, bound in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', bound)])} {entry[index]}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', '+Inf')])} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {entry[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {entry[-1]}")
+        return lines
+
+def render_gauge(name, documentation, samples, labelnames=()):
+    """Lines for a gauge computed at scrape time, samples is [(labels, value)]"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labelnames, labels)} {value}")
+    return lines
+
+HTTP_REQUEST_SECONDS = Histogram('pos_http_request_duration_seconds', 'Request duration per Flask endpoint', ('endpoint', 'method'))
+HTTP_REQUESTS = Counter('pos_http_requests_total', 'Requests per Flask endpoint and status', ('endpoint', 'method', 'status'))
+HTTP_REQUEST_QUERIES = Histogram('pos_http_request_queries', 'SQL queries issued per request', ('endpoint',), QUERY_COUNT_BUCKETS)
+HTTP_REQUEST_DB_SECONDS = Histogram('pos_http_request_db_seconds', 'Time spent in SQL per request', ('endpoint',))
+DB_QUERY_SECONDS = Histogram('pos_db_query_duration_seconds', 'SQL statement duration by statement type', ('statement',))
+DB_COMMIT_SECONDS = Histogram('pos_db_commit_duration_seconds', 'Session commit duration, including before_commit hooks')
+QR_RENDER_SECONDS = Histogram('pos_qr_render_duration_seconds', 'QR code PNG render time')
+SYNC_ITEMS = Counter('pos_sync_items_total', 'Sync queue items applied, by result', ('result',))
+SYNC_WAKEUPS = Counter('pos_sync_wakeups_total', 'Background drain wakeups, by cause', ('cause',))
+SYNC_RETENTION_ROWS = Counter('pos_sync_retention_rows_total', 'sync_queue rows removed by retention, by action', ('action',))
+SYNC_RETENTION_SECONDS = Histogram('pos_sync_retention_duration_seconds', 'Duration of a retention run', buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900))
+DEVICE_HEARTBEATS = Counter('pos_device_heartbeats_total', 'Device heartbeats received, by channel', ('channel',))
+DEVICE_PRESENCE_ROWS = Counter('pos_device_presence_rows_written_total', 'Device rows written by presence flushes and sweeps, by action', ('action',))
+SYNC_COUNTER_DRIFT = Counter('pos_sync_pending_counter_drift_total', 'Pending sync items the counter reconciliation had to correct')
+DB_READ_ROUTES = Counter('pos_db_read_routes_total', 'Read-only requests by database used and why', ('target', 'reason'))
+SYNC_RUNS_SKIPPED = Counter('pos_sync_runs_skipped_total', 'Drains skipped because another drain held the sync lock')
+DB_POOL_CHECKOUT_SECONDS = Histogram('pos_db_pool_checkout_seconds', 'Wait for a pooled database connection (connect time under NullPool)')
+DB_POOL_CHECKOUT_ERRORS = Counter('pos_db_pool_checkout_errors_total', 'Connection checkouts that timed out or failed to connect')
+METRICS = [
+    HTTP_REQUEST_SECONDS, HTTP_REQUESTS, HTTP_REQUEST_QUERIES, HTTP_REQUEST_DB_SECONDS,
+    DB_QUERY_SECONDS, DB_COMMIT_SECONDS, QR_RENDER_SECONDS, SYNC_ITEMS, SYNC_WAKEUPS, SYNC_RETENTION_ROWS, SYNC_RETENTION_SECONDS, SYNC_RUNS_SKIPPED, SYNC_COUNTER_DRIFT,
+    DEVICE_HEARTBEATS, DEVICE_PRESENCE_ROWS,
+    DB_POOL_CHECKOUT_SECONDS, DB_POOL_CHECKOUT_ERRORS, DB_READ_ROUTES
+]
+
+# Background thread liveness: name -> (thread, last heartbeat time)
+background_threads = {}
+
+def register_background_thread(name, thread):
+    background_threads[name] = (thread, time.time())
+
+def background_heartbeat(name):
+    entry = background_threads.get(name)
+    if entry:
+        background_threads[name] = (entry[0], time.time())
+
+# Per-request query counting and timing
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    verb = statement.lstrip().split(' ', 1)[0].upper()
+    DB_QUERY_SECONDS.observe(elapsed, verb)
+    if has_request_context():
+        g.query_seconds = g.get('query_seconds', 0.0) + elapsed
+        if verb in ('INSERT', 'UPDATE', 'DELETE'):
+            g.db_wrote = True
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _add_query_count_header(response):
+    if app.config['QUERY_COUNT_HEADER']:
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+    
+    endpoint = request.endpoint or 'unmatched'
+    if 'request_started' in g:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint, request.method)
+    HTTP_REQUESTS.inc(endpoint, request.method, response.status_code)
+    HTTP_REQUEST_QUERIES.observe(g.get('query_count', 0), endpoint)
+    HTTP_REQUEST_DB_SECONDS.observe(g.get('query_seconds', 0.0), endpoint)
+    if g.get('db_wrote') and app.config['DATABASE_REPLICA_URL']:
+        replica_router.stick(response)
+    return response
 
 # Serve Frontend
 @app.route('/')
@@ -60,7 +411,7 @@ def index():
 # Database Models
 class Product(db.Model):
     __tablename__ = 'products'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDType, primary_key=True, default=new_id)
     name = db.Column(db.String(200), nullable=False)
     price = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(100))
@@ -75,7 +426,7 @@ class Product(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'orders'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDType, primary_key=True, default=new_id)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
     tax_amount = db.Column(db.Float, default=0.0)
@@ -90,95 +441,254 @@ class Order(db.Model):
     device_id = db.Column(db.String(100))  # For offline mode tracking
     sync_status = db.Column(db.String(20), default='pending')  # pending, synced, failed
     barcode_data = db.Column(db.Text)  # Stores QR code data
-    barcode_image = db.Column(db.Text)  # Base64 encoded QR image
-    metadata_json = db.Column('metadata', JSONB)  # Store additional data like items, timestamps
+    barcode_image = db.Column(db.Text)  # Legacy base64 QR image, images are now rendered from barcode_data
+    metadata_json = db.Column('metadata', JSONType)  # Store additional data like items, timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Lazy by default, hot endpoints opt into selectinload
+    order_items = db.relationship(
+        'OrderItem',
+        back_populates='order',
+        cascade='all, delete-orphan',
+        order_by='OrderItem.created_at'
+    )
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    order_id = db.Column(db.String(36), db.ForeignKey('orders.id'), nullable=False)
-    product_id = db.Column(db.String(36), db.ForeignKey('products.id'), nullable=False)
+    id = db.Column(UUIDType, primary_key=True, default=new_id)
+    order_id = db.Column(UUIDType, db.ForeignKey('orders.id'), nullable=False)
+    product_id = db.Column(UUIDType, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
     product_name = db.Column(db.String(200))  # Cache product name at time of order
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    order = db.relationship('Order', back_populates='order_items')
+    product = db.relationship('Product')
 
 class SyncQueue(db.Model):
     __tablename__ = 'sync_queue'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDType, primary_key=True, default=new_id)
     entity_type = db.Column(db.String(50), nullable=False)  # order, product, inventory
-    entity_id = db.Column(db.String(36), nullable=False)
+    entity_id = db.Column(UUIDType, nullable=False)
     operation = db.Column(db.String(20), nullable=False)  # create, update, delete
-    data = db.Column(JSONB, nullable=False)  # The actual data to sync
+    data = db.Column(JSONType, nullable=False)  # The actual data to sync
     device_id = db.Column(db.String(100))
-    status = db.Column(db.String(20), default='pending')  # pending, processing, completed, failed
+    job_id = db.Column(UUIDType)  # Push request that queued this item
+    status = db.Column(db.String(20), default='pending')  # pending, retry, completed (failed on older rows)
     retry_count = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)  # When a retry row becomes due
+    last_error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Batch claiming scans pending rows in created_at order
+        db.Index('idx_sync_queue_status_created_at', 'status', 'created_at'),
+        # Retention walks finished rows in updated_at order
+        db.Index('idx_sync_queue_status_updated_at', 'status', 'updated_at'),
+        # Retries are claimed separately, in due order
+        db.Index('idx_sync_queue_status_next_attempt_at', 'status', 'next_attempt_at'),
+        db.Index('idx_sync_queue_job_id', 'job_id'),
+        # Follower workers count a device's pending rows for status polls
+        db.Index('idx_sync_queue_device_status', 'device_id', 'status'),
+    )
+
+class SyncDeadLetter(db.Model):
+    __tablename__ = 'sync_dead_letters'
+    id = db.Column(UUIDType, primary_key=True)  # Id the row had in sync_queue
+    entity_type = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(UUIDType, nullable=False)
+    operation = db.Column(db.String(20), nullable=False)
+    data = db.Column(JSONType, nullable=False)
+    device_id = db.Column(db.String(100))
+    job_id = db.Column(UUIDType)
+    retry_count = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)  # When the item was first queued
+    failed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_sync_dead_letters_job_id', 'job_id'),
+    )
+
 class Device(db.Model):
     __tablename__ = 'devices'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDType, primary_key=True, default=new_id)
     device_id = db.Column(db.String(100), unique=True, nullable=False)
     name = db.Column(db.String(200))
     location = db.Column(db.String(200))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     is_online = db.Column(db.Boolean, default=False)
     ip_address = db.Column(db.String(50))
+    store_id = db.Column(db.String(100))  # Realtime events fan out per store
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-# Barcode Generator
-class BarcodeGenerator:
+class CatalogState(db.Model):
+    __tablename__ = 'catalog_state'
+    id = db.Column(db.Integer, primary_key=True)  # Single row, id 1
+    version = db.Column(db.BigInteger, nullable=False, default=0)  # Bumped on every catalog change
+
+class SalesRollup(db.Model):
+    __tablename__ = 'sales_rollups'
+    bucket_date = db.Column(db.Date, primary_key=True)
+    bucket_hour = db.Column(db.SmallInteger, primary_key=True)  # 0-23, UTC
+    device_id = db.Column(db.String(100), primary_key=True, default='')  # '' when the order has no device
+    channel = db.Column(db.String(10), primary_key=True)  # online, offline
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_sales = db.Column(db.Numeric(12, 2, asdecimal=False), nullable=False, default=0.0)  # DECIMAL(12,2) as in sgl.sql
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    seq = db.Column(db.BigInteger, primary_key=True, autoincrement=False)  # Allocated at commit, see _write_change_log
+    entity_type = db.Column(db.String(50), nullable=False)  # product, order
+    entity_id = db.Column(UUIDType, nullable=False)
+    device_id = db.Column(db.String(100))  # Device that caused the change
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Maps legacy last_sync timestamps onto a starting seq
+        db.Index('idx_change_log_created_at', 'created_at'),
+    )
+
+class ChangeLogState(db.Model):
+    __tablename__ = 'change_log_state'
+    id = db.Column(db.Integer, primary_key=True)  # Single row, id 1
+    last_seq = db.Column(db.BigInteger, nullable=False, default=0)
+
+# Realtime fan-out
+class RealtimeHub:
+    """Routes socket events to per-device and per-store rooms and coalesces bursts"""
+    def __init__(self, socketio, coalesce_ms):
+        self.socketio = socketio
+        self.window = coalesce_ms / 1000.0
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._device_stores = {}
+        self.metrics = {'emitted': 0, 'coalesced': 0}
+    
     @staticmethod
-    def generate_qr_code(order_data):
-        """Generate QR code for an order"""
+    def device_room(device_id):
+        return f"device:{device_id}"
+    
+    @staticmethod
+    def store_room(store_id):
+        return f"store:{store_id}"
+    
+    def join(self, device_id, store_id=None):
+        """Put the calling socket into its device and store rooms"""
+        if not device_id:
+            return
+        join_room(self.device_room(device_id))
+        store_id = store_id or self.store_for(device_id)
+        if store_id:
+            self._device_stores[device_id] = store_id
+            join_room(self.store_room(store_id))
+    
+    def remember_store(self, device_id, store_id):
+        if device_id and store_id:
+            self._device_stores[device_id] = store_id
+    
+    def store_for(self, device_id):
+        """Store of a device, from memory or the devices table"""
+        if not device_id:
+            return None
+        if device_id not in self._device_stores:
+            self._device_stores[device_id] = db.session.query(Device.store_id).filter(
+                Device.device_id == device_id
+            ).scalar()
+        return self._device_stores[device_id]
+    
+    def emit(self, event, payload, room=None, coalesce_key=None):
+        """Emit to a room (everyone when None). Events sharing a coalesce_key
+        within the window are collapsed so only the latest payload is sent."""
+        if coalesce_key is None or self.window <= 0:
+            self._send(event, payload, room)
+            return
+        
+        with self._lock:
+            key = (event, room, coalesce_key)
+            if key in self._pending:
+                self.metrics['coalesced'] += 1
+            self._pending[key] = payload
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+    
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = OrderedDict()
+            self._timer = None
+        for (event, room, _), payload in pending.items():
+            self._send(event, payload, room)
+    
+    def _send(self, event, payload, room):
         try:
-            # Create order payload for QR code
-            qr_payload = {
-                'order_id': order_data.get('id'),
-                'order_number': order_data.get('order_number'),
-                'total': order_data.get('total_amount'),
-                'timestamp': order_data.get('created_at'),
-                'items': order_data.get('items', []),
-                'customer_id': order_data.get('customer_id'),
-                'verification_hash': hashlib.sha256(
-                    f"{order_data.get('id')}{order_data.get('created_at')}{os.getenv('QR_SECRET', 'default-secret')}".encode()
-                ).hexdigest()[:16]
-            }
-            
-            # Convert to JSON string
-            qr_string = json.dumps(qr_payload, default=str)
-            
-            # Generate QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_string)
-            qr.make(fit=True)
-            
-            # Create image
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convert to base64
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            
-            return {
-                'qr_data': qr_string,
-                'qr_image': img_str,
-                'qr_type': 'QR_CODE'
-            }
+            if room is None:
+                self.socketio.emit(event, payload)
+            else:
+                self.socketio.emit(event, payload, to=room)
+            self.metrics['emitted'] += 1
         except Exception as e:
-            logger.error(f"Error generating QR code: {str(e)}")
-            return None
+            logger.error(f"Error emitting {event}: {str(e)}")
+    
+    def emit_to_store_of(self, device_id, event, payload, coalesce_key=None):
+        """Emit to the tills in a device's store, or to everyone if the store is unknown"""
+        store_id = self.store_for(device_id)
+        self.emit(event, payload, room=self.store_room(store_id) if store_id else None, coalesce_key=coalesce_key)
+    
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'stores_known': len(self._device_stores), **self.metrics}
+
+realtime = RealtimeHub(socketio, app.config['REALTIME_COALESCE_MS'])
 
+# Barcode Generator
+def _render_qr_png(qr_string):
+    """Render a QR payload to PNG bytes, returns (png_bytes, seconds). Runs in QR worker processes."""
+    import qrcode  # pulls in PIL, deferred so processes that never render skip it
+    
+    started = time.perf_counter()
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(qr_string)
+    qr.make(fit=True)
+    
+    # Create image
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue(), time.perf_counter() - started
+
+class BarcodeGenerator:
+    @staticmethod
+    def build_qr_payload(order_data):
+        """Build the signed QR payload string for an order (cheap, no rendering).
+        Line items stay out so the payload fits a QR code at any basket size; scans read them from the order."""
+        qr_payload = {
+            'order_id': order_data.get('id'),
+            'order_number': order_data.get('order_number'),
+            'total': order_data.get('total_amount'),
+            'timestamp': order_data.get('created_at'),
+            'customer_id': order_data.get('customer_id'),
+            'verification_hash': hashlib.sha256(
+                f"{order_data.get('id')}{order_data.get('created_at')}{os.getenv('QR_SECRET', 'default-secret')}".encode()
+            ).hexdigest()[:16]
+        }
+        
+        # Convert to JSON string
+        return json.dumps(qr_payload, default=str)
+    
     @staticmethod
     def generate_code128(order_number):
         """Generate Code128 barcode"""
@@ -189,11 +699,1112 @@ class BarcodeGenerator:
             'barcode_type': 'CODE128'
         }
 
+# QR render pool
+class QRRenderPool:
+    """Renders QR images in worker processes behind a bounded queue"""
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor = None
+        self._store_executor = None
+        self._pending = 0
+        self.metrics = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'render_seconds_total': 0.0,
+            'render_seconds_max': 0.0
+        }
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qr-store')
+            return self._executor
+    
+    def _record(self, seconds=None, failed=False):
+        with self._lock:
+            if failed:
+                self.metrics['failed'] += 1
+            else:
+                self.metrics['completed'] += 1
+                self.metrics['render_seconds_total'] += seconds
+                self.metrics['render_seconds_max'] = max(self.metrics['render_seconds_max'], seconds)
+        if not failed:
+            QR_RENDER_SECONDS.observe(seconds)
+    
+    def submit(self, qr_string, on_done):
+        """Queue a background render, on_done(png_bytes) runs off the request thread.
+        Returns False when rendering is disabled or the queue is full."""
+        if self.workers <= 0:
+            return False
+        
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.metrics['rejected'] += 1
+                return False
+            self._pending += 1
+            self.metrics['submitted'] += 1
+        
+        try:
+            future = self._get_executor().submit(_render_qr_png, qr_string)
+        except Exception as e:
+            logger.error(f"Error submitting QR render: {str(e)}")
+            with self._lock:
+                self._pending -= 1
+            self._record(failed=True)
+            return False
+        
+        future.add_done_callback(lambda f: self._finish(f, on_done))
+        return True
+    
+    def _finish(self, future, on_done):
+        with self._lock:
+            self._pending -= 1
+        try:
+            png_bytes, seconds = future.result()
+        except Exception as e:
+            logger.error(f"Error rendering QR code: {str(e)}")
+            self._record(failed=True)
+            return
+        self._record(seconds)
+        try:
+            self._store_executor.submit(on_done, png_bytes)
+        except RuntimeError:
+            # Interpreter shutting down, the image will be rendered on demand
+            pass
+    
+    def render(self, qr_string, timeout=10):
+        """Render synchronously, through the pool when it is enabled.
+        Returns None when the pool's queue is full, so request threads never pile up behind it."""
+        if self.workers <= 0:
+            png_bytes, seconds = _render_qr_png(qr_string)
+            self._record(seconds)
+            return png_bytes
+        
+        # Waiting renders count against the same bound as background ones
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.metrics['rejected'] += 1
+                return None
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(_render_qr_png, qr_string)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        # The slot is freed when the render ends, even if this request stopped waiting for it
+        future.add_done_callback(self._release)
+        png_bytes, seconds = future.result(timeout=timeout)
+        self._record(seconds)
+        return png_bytes
+    
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+    
+    def stats(self):
+        with self._lock:
+            completed = self.metrics['completed']
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                **self.metrics,
+                'render_seconds_avg': round(self.metrics['render_seconds_total'] / completed, 4) if completed else 0.0
+            }
+
+qr_pool = QRRenderPool(app.config['QR_RENDER_WORKERS'], app.config['QR_RENDER_QUEUE'])
+
+class BarcodeImageCache:
+    """Size-bounded LRU of rendered QR PNGs keyed by payload ETag"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, key):
+        with self._lock:
+            png_bytes = self._items.get(key)
+            if png_bytes is None:
+                self.metrics['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.metrics['hits'] += 1
+            return png_bytes
+    
+    def put(self, key, png_bytes):
+        if len(png_bytes) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._items[key] = png_bytes
+            self._bytes += len(png_bytes)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.metrics['evictions'] += 1
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                **self.metrics
+            }
+
+barcode_cache = BarcodeImageCache(app.config['QR_CACHE_BYTES'])
+
+def barcode_etag(barcode_data):
+    """Content hash of a QR payload, the rendered PNG only depends on it"""
+    return hashlib.sha256(barcode_data.encode()).hexdigest()[:32]
+
+# Byte-mode capacity of the largest QR code (version 40) at the error correction _render_qr_png uses
+QR_MAX_PAYLOAD_BYTES = 2953
+
+def barcode_renderable(barcode_data):
+    """False for payloads no QR code can hold, e.g. an oversized one sent by an offline till"""
+    return bool(barcode_data) and len(barcode_data.encode()) <= QR_MAX_PAYLOAD_BYTES
+
+def barcode_url(order_id, barcode_data):
+    """Image URL for an order's QR code, None when the payload cannot be rendered"""
+    return f"/api/orders/{order_id}/barcode.png" if barcode_renderable(barcode_data) else None
+
+def _queue_barcode_render(order_id, qr_string, device_id=None):
+    """Pre-render an order's QR image into the cache and tell the ordering till it is ready"""
+    if not barcode_renderable(qr_string):
+        return False
+    etag = barcode_etag(qr_string)
+    if barcode_cache.get(etag) is not None:
+        return True
+    
+    def on_done(png_bytes):
+        barcode_cache.put(etag, png_bytes)
+        realtime.emit('barcode_ready', {
+            'order_id': order_id,
+            'image_url': barcode_url(order_id, qr_string)
+        }, room=realtime.device_room(device_id) if device_id else None)
+    
+    return qr_pool.submit(qr_string, on_done)
+
+def _barcode_response(order):
+    return {
+        'qr_data': order.barcode_data,
+        'qr_type': 'QR_CODE',
+        'image_url': barcode_url(order.id, order.barcode_data)
+    }
+
+# Product catalog cache
+def mark_catalog_changed(*product_ids):
+    """Flag the current transaction as changing products, the version is bumped on commit"""
+    db.session.info['catalog_changed'] = True
+    for product_id in product_ids:
+        record_change('product', product_id)
+
+@event.listens_for(db.session, 'before_commit')
+def _bump_catalog_version(session):
+    # One bump per transaction keeps the hot version row locked only briefly.
+    # Releasing a savepoint also fires before_commit, the bump waits for the real commit
+    if session.in_nested_transaction():
+        return
+    if not session.info.pop('catalog_changed', False):
+        return
+    updated = session.execute(
+        CatalogState.__table__.update().where(CatalogState.id == 1).values(version=CatalogState.version + 1)
+    ).rowcount
+    if not updated:
+        session.execute(CatalogState.__table__.insert().values(id=1, version=1))
+
+def current_catalog_version():
+    return db.session.query(CatalogState.version).filter(CatalogState.id == 1).scalar() or 0
+
+class CatalogCache:
+    """Pre-serialized product list JSON per (category, available_only) view, valid for one catalog version"""
+    def __init__(self, max_views):
+        self.max_views = max_views
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'not_modified': 0}
+    
+    @staticmethod
+    def etag(version, category, available_only):
+        view = hashlib.sha256(f"{category}|{available_only}".encode()).hexdigest()[:8]
+        return f"catalog-{version}-{view}"
+    
+    def get(self, version, category, available_only):
+        """Return (etag, body) for the view, rebuilding it if the version moved on"""
+        key = (category, available_only)
+        with self._lock:
+            cached = self._views.get(key)
+            if cached and cached[0] == version:
+                self._views.move_to_end(key)
+                self.metrics['hits'] += 1
+                return cached[1], cached[2]
+            self.metrics['misses'] += 1
+        
+        body = self._build(category, available_only)
+        etag = self.etag(version, category, available_only)
+        with self._lock:
+            self._views[key] = (version, etag, body)
+            self._views.move_to_end(key)
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        return etag, body
+    
+    def _build(self, category, available_only):
+        query = db.session.query(
+            Product.id,
+            Product.name,
+            Product.price,
+            Product.category,
+            Product.sku,
+            Product.inventory_count,
+            Product.is_available,
+            Product.image_url
+        )
+        
+        if category:
+            query = query.filter(Product.category == category)
+        
+        if available_only:
+            query = query.filter(Product.is_available == True)
+        
+        return json.dumps([{
+            'id': p.id,
+            'name': p.name,
+            'price': p.price,
+            'category': p.category,
+            'sku': p.sku,
+            'inventory_count': p.inventory_count,
+            'is_available': p.is_available,
+            'image_url': p.image_url
+        } for p in query.order_by(Product.name).all()], separators=(',', ':'))
+    
+    def record_not_modified(self):
+        with self._lock:
+            self.metrics['not_modified'] += 1
+    
+    def stats(self):
+        with self._lock:
+            return {'views': len(self._views), 'max_views': self.max_views, **self.metrics}
+
+catalog_cache = CatalogCache(app.config['CATALOG_CACHE_VIEWS'])
+
+# Change log
+def record_change(entity_type, entity_id, device_id=None):
+    """Note an entity change for delta sync, written to change_log when the transaction commits"""
+    db.session.info.setdefault('changes', []).append((entity_type, entity_id, device_id))
+
+@event.listens_for(db.session, 'before_commit')
+def _write_change_log(session):
+    # Allocating seq under the state row lock means entries become visible
+    # in seq order, so a pull cursor never skips a slower concurrent writer
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop('changes', None)
+    if not changes:
+        return
+    now = datetime.utcnow()
+    count = len(changes)
+    state = ChangeLogState.__table__
+    last_seq = session.execute(
+        state.update().where(state.c.id == 1).values(last_seq=state.c.last_seq + count).returning(state.c.last_seq)
+    ).scalar()
+    if last_seq is None:
+        session.execute(state.insert().values(id=1, last_seq=count))
+        last_seq = count
+    
+    first_seq = last_seq - count + 1
+    session.info['changes_written'] = True
+    session.execute(ChangeLog.__table__.insert(), [{
+        'seq': first_seq + offset,
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'device_id': device_id,
+        'created_at': now
+    } for offset, (entity_type, entity_id, device_id) in enumerate(changes)])
+
+@event.listens_for(db.session, 'before_commit', insert=True)
+def _start_commit_timer(session):
+    # insert=True runs this before the catalog, change log and rollup hooks
+    if not session.in_nested_transaction():
+        session.info['commit_started'] = time.perf_counter()
+
+@event.listens_for(db.session, 'after_commit')
+def _observe_commit(session):
+    started = session.info.pop('commit_started', None)
+    if started is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+# Work recorded in session.info and applied by the commit hooks
+STAGED_SESSION_KEYS = ('changes', 'catalog_changed', 'sales', 'sync_wakeup', 'sync_pending')
+
+def _staged_snapshot(session):
+    return {key: copy.copy(session.info[key]) for key in STAGED_SESSION_KEYS if key in session.info}
+
+@event.listens_for(db.session, 'after_transaction_create')
+def _snapshot_staged_work(session, transaction):
+    # A savepoint starts from a copy, so work recorded inside it can be dropped if it rolls back
+    if transaction.nested:
+        session.info.setdefault('staged_snapshots', []).append(_staged_snapshot(session))
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _release_staged_snapshot(session, transaction):
+    snapshots = session.info.get('staged_snapshots')
+    if transaction.nested and snapshots:
+        snapshots.pop()
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending_changes(session):
+    if session.in_nested_transaction():
+        # A savepoint rollback only undoes its own work, what was recorded before it still commits
+        snapshots = session.info.get('staged_snapshots')
+        if snapshots:
+            for key in STAGED_SESSION_KEYS:
+                session.info.pop(key, None)
+            session.info.update(snapshots[-1])
+        return
+    for key in STAGED_SESSION_KEYS:
+        session.info.pop(key, None)
+    session.info.pop('changes_written', None)
+
+def encode_sync_cursor(seq):
+    return base64.urlsafe_b64encode(f"v1:{seq}".encode()).decode()
+
+def decode_sync_cursor(cursor):
+    """Return the seq behind an opaque pull cursor, ValueError if it is malformed"""
+    try:
+        version, seq = base64.urlsafe_b64decode(cursor.encode()).decode().split(':', 1)
+        if version != 'v1':
+            raise ValueError(version)
+        return int(seq)
+    except Exception:
+        raise ValueError(f"Invalid sync cursor: {cursor}")
+
+# Sales rollups
+def record_sale(created_at, device_id, is_online, amount):
+    """Count a completed order in the sales rollups when the current transaction commits"""
+    sales = db.session.info.setdefault('sales', {})
+    key = (created_at.date(), created_at.hour, device_id or '', 'online' if is_online else 'offline')
+    count, total = sales.get(key, (0, 0.0))
+    sales[key] = (count + 1, total + (amount or 0))
+
+def _dialect_insert(session, table):
+    """INSERT that supports on_conflict_do_update for the bound database"""
+    if session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def upsert_sales_rollups(session, sales):
+    """Add {(date, hour, device_id, channel): (count, total)} onto the rollup rows"""
+    table = SalesRollup.__table__
+    now = datetime.utcnow()
+    stmt = _dialect_insert(session, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.bucket_date, table.c.bucket_hour, table.c.device_id, table.c.channel],
+        set_={
+            'order_count': table.c.order_count + stmt.excluded.order_count,
+            'total_sales': table.c.total_sales + stmt.excluded.total_sales,
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+    session.execute(stmt, [{
+        'bucket_date': bucket_date,
+        'bucket_hour': bucket_hour,
+        'device_id': device_id,
+        'channel': channel,
+        'order_count': count,
+        'total_sales': total,
+        'updated_at': now
+    } for (bucket_date, bucket_hour, device_id, channel), (count, total) in sales.items()])
+
+@event.listens_for(db.session, 'before_commit')
+def _write_sales_rollups(session):
+    if session.in_nested_transaction():
+        return
+    sales = session.info.pop('sales', None)
+    if sales:
+        upsert_sales_rollups(session, sales)
+
+def rebuild_sales_rollups():
+    """Recompute every rollup row from completed orders"""
+    sales = {}
+    completed = db.session.query(
+        Order.created_at,
+        Order.device_id,
+        Order.is_online,
+        Order.total_amount
+    ).filter(Order.status == 'completed').execution_options(yield_per=5000)
+    for order in completed:
+        key = (order.created_at.date(), order.created_at.hour, order.device_id or '', 'online' if order.is_online else 'offline')
+        count, total = sales.get(key, (0, 0.0))
+        sales[key] = (count + 1, total + (order.total_amount or 0))
+    
+    SalesRollup.query.delete(synchronize_session=False)
+    if sales:
+        upsert_sales_rollups(db.session, sales)
+    db.session.commit()
+    return len(sales)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Backfill sales_rollups from the orders table."""
+    logger.info(f"Rebuilt {rebuild_sales_rollups()} sales rollup buckets")
+
+class TTLCache:
+    """Tiny thread-safe cache whose entries expire after ttl seconds"""
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            return None
+    
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+
+dashboard_cache = TTLCache(app.config['DASHBOARD_CACHE_TTL'])
+
+# Read replica routing
+class ReplicaRouter:
+    """Decides whether a read-only request may use DATABASE_REPLICA_URL.
+    Lag is measured on the change log: the replica is as old as the first entry it has not
+    replayed yet, which also works for stand-in replicas without WAL functions. Clients that just wrote keep reading from the primary for
+    REPLICA_STICKY_SECONDS, through a cookie and through their device_id."""
+    COOKIE = 'pos_read_primary_until'
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._sticky_devices = {}  # device_id -> time until which its reads stay on the primary
+        self.lag_seconds = None
+        self.healthy = False
+        self.checked_at = None
+    
+    def check(self):
+        """Measure replica lag, marking the replica unhealthy if it cannot be read"""
+        try:
+            with db.engines['replica'].connect() as conn:
+                replica_head = conn.execute(
+                    db.select(ChangeLogState.last_seq).where(ChangeLogState.id == 1)
+                ).scalar() or 0
+            with db.engine.connect() as conn:
+                missing_since = conn.execute(
+                    db.select(ChangeLog.created_at).where(ChangeLog.seq == replica_head + 1)
+                ).scalar()
+        except Exception as e:
+            logger.error(f"Replica lag check failed: {str(e)}")
+            self.healthy = False
+            self.checked_at = time.monotonic()
+            return None
+        
+        self.lag_seconds = round(max(0.0, (datetime.utcnow() - missing_since).total_seconds()), 3) if missing_since else 0.0
+        self.healthy = True
+        self.checked_at = time.monotonic()
+        return self.lag_seconds
+    
+    def _refresh(self):
+        due = self.checked_at is None or time.monotonic() - self.checked_at >= app.config['REPLICA_LAG_CHECK_SECONDS']
+        # One request measures at a time, the others use the last result
+        if due and self._check_lock.acquire(blocking=False):
+            try:
+                self.check()
+            finally:
+                self._check_lock.release()
+    
+    def route(self):
+        """'replica' or 'primary' for the current request, with the reason"""
+        self._refresh()
+        if not self.healthy:
+            return 'primary', 'unavailable'
+        if self.lag_seconds is not None and self.lag_seconds > app.config['REPLICA_MAX_LAG_SECONDS']:
+            return 'primary', 'lagging'
+        
+        now = time.time()
+        try:
+            sticky_until = float(request.cookies.get(self.COOKIE, 0))
+        except ValueError:
+            sticky_until = 0
+        device_id = _request_device_id()
+        with self._lock:
+            if device_id:
+                sticky_until = max(sticky_until, self._sticky_devices.get(device_id, 0))
+        if sticky_until > now:
+            return 'primary', 'sticky'
+        return 'replica', 'replica'
+    
+    def stick(self, response):
+        """Keep the client that made this write on the primary for REPLICA_STICKY_SECONDS"""
+        until = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        response.set_cookie(self.COOKIE, f"{until:.3f}", max_age=int(app.config['REPLICA_STICKY_SECONDS']) + 1,
+                            httponly=True, samesite='Lax')
+        device_id = _request_device_id()
+        if device_id:
+            with self._lock:
+                self._sticky_devices[device_id] = until
+                # Forget devices whose window has passed
+                if len(self._sticky_devices) > 1000:
+                    now = time.time()
+                    self._sticky_devices = {key: value for key, value in self._sticky_devices.items() if value > now}
+    
+    def stats(self):
+        return {
+            'enabled': bool(app.config['DATABASE_REPLICA_URL']),
+            'healthy': self.healthy,
+            'lag_seconds': self.lag_seconds,
+            'max_lag_seconds': app.config['REPLICA_MAX_LAG_SECONDS']
+        }
+
+replica_router = ReplicaRouter()
+
+def _request_device_id():
+    """device_id from the query string, or the one a view stored on g after parsing its body.
+    The body itself is never read here, sync views stream it themselves."""
+    return request.args.get('device_id') or g.get('device_id')
+
+def choose_read_source():
+    """'replica' or 'primary' for the reads of the current read_replica view"""
+    target, reason = replica_router.route()
+    DB_READ_ROUTES.inc(target, reason)
+    g.read_source = target
+    return target
+
+def read_replica(view):
+    """Run a read-only view against the replica when one is configured and fresh enough.
+    The choice is made at the view's first read, so a device_id from the body can keep it sticky."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config['DATABASE_REPLICA_URL']:
+            return view(*args, **kwargs)
+        g.read_source = 'primary'
+        db.session.info['read_replica'] = 'pending'
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        finally:
+            db.session.info.pop('read_replica', None)
+        response.headers['X-Read-Source'] = g.read_source
+        return response
+    return wrapper
+
+def use_primary():
+    """Send the rest of a read_replica view to the primary, e.g. when the replica lacks a row"""
+    if db.session.info.pop('read_replica', None) == 'replica':
+        g.read_source = 'primary'
+        return True
+    return False
+
+# Device presence
+class DevicePresence:
+    """In-memory presence map fed by heartbeats. Beats are coalesced per device and written
+    as one batched upsert every DEVICE_HEARTBEAT_FLUSH_SECONDS, and a sweeper marks devices
+    offline once they have been silent for DEVICE_OFFLINE_AFTER_SECONDS."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen = {}  # device_id -> last heartbeat time
+        self._dirty = {}  # device_id -> (last heartbeat time, ip address) not yet written
+        self._loaded_at = None
+        self.last_flush = time.monotonic()
+        self.background = False  # True once the background flusher runs in this process
+    
+    def _load(self):
+        """Merge last_seen from the devices table, so beats other processes wrote show up"""
+        rows = db.session.query(Device.device_id, Device.last_seen).all()
+        with self._lock:
+            for device_id, last_seen in rows:
+                if last_seen and (device_id not in self._seen or self._seen[device_id] < last_seen):
+                    self._seen[device_id] = last_seen
+            self._loaded_at = time.monotonic()
+    
+    def remember(self, device_id, seen_at):
+        """Record a write made elsewhere (registration) without scheduling another one"""
+        with self._lock:
+            self._seen[device_id] = max(seen_at, self._seen.get(device_id, seen_at))
+    
+    def beat(self, device_id, ip_address=None):
+        """Record a heartbeat, returns its time or None for devices that were never registered"""
+        if not device_id:
+            return None
+        with self._lock:
+            known = device_id in self._seen
+        if not known and db.session.query(Device.id).filter(Device.device_id == device_id).first() is None:
+            return None
+        
+        now = datetime.utcnow()
+        with self._lock:
+            self._seen[device_id] = now
+            self._dirty[device_id] = (now, ip_address or self._dirty.get(device_id, (None, None))[1])
+        # Without a background flusher (serverless), the request that finds the interval elapsed writes the batch
+        if not self.background and time.monotonic() - self.last_flush >= app.config['DEVICE_HEARTBEAT_FLUSH_SECONDS']:
+            self.flush()
+        return now
+    
+    def flush(self):
+        """Write pending heartbeats as one upsert, returns the number of devices written"""
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+        
+        table = Device.__table__
+        stmt = _dialect_insert(db.session, table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.device_id],
+            set_={
+                # Flushes from several processes may land out of order, last_seen never moves back
+                'last_seen': case(
+                    (or_(table.c.last_seen.is_(None), stmt.excluded.last_seen > table.c.last_seen), stmt.excluded.last_seen),
+                    else_=table.c.last_seen
+                ),
+                'is_online': True,
+                'ip_address': func.coalesce(stmt.excluded.ip_address, table.c.ip_address)
+            }
+        )
+        try:
+            db.session.execute(stmt, [{
+                'device_id': device_id,
+                'last_seen': last_seen,
+                'is_online': True,
+                'ip_address': ip_address
+            } for device_id, (last_seen, ip_address) in pending.items()])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Put the beats back unless newer ones arrived meanwhile
+            with self._lock:
+                for device_id, entry in pending.items():
+                    self._dirty.setdefault(device_id, entry)
+            raise
+        DEVICE_PRESENCE_ROWS.inc('heartbeat', amount=len(pending))
+        return len(pending)
+    
+    def sweep(self):
+        """Mark devices offline after DEVICE_OFFLINE_AFTER_SECONDS of silence, returns how many"""
+        cutoff = datetime.utcnow() - timedelta(seconds=app.config['DEVICE_OFFLINE_AFTER_SECONDS'])
+        result = db.session.execute(
+            update(Device)
+            .where(Device.is_online == True, or_(Device.last_seen.is_(None), Device.last_seen < cutoff))
+            .values(is_online=False)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount:
+            DEVICE_PRESENCE_ROWS.inc('offline', amount=result.rowcount)
+            logger.info(f"Marked {result.rowcount} silent devices offline")
+        self._load()
+        return result.rowcount
+    
+    def snapshot(self, device_id=None):
+        """Presence of every known device (or one), computed from the map without a query"""
+        # The background sweeper reloads the map, without it (serverless) reads refresh it
+        if self._loaded_at is None or (not self.background and time.monotonic() - self._loaded_at >= app.config['DEVICE_HEARTBEAT_FLUSH_SECONDS']):
+            self._load()
+        now = datetime.utcnow()
+        offline_after = app.config['DEVICE_OFFLINE_AFTER_SECONDS']
+        with self._lock:
+            seen = dict(self._seen) if device_id is None else {device_id: self._seen[device_id]} if device_id in self._seen else {}
+        devices = []
+        for key, last_seen in sorted(seen.items()):
+            silent = (now - last_seen).total_seconds()
+            devices.append({
+                'device_id': key,
+                'last_seen': last_seen.isoformat(),
+                'seconds_since_seen': round(silent, 1),
+                'online': silent < offline_after
+            })
+        return devices
+    
+    def stats(self):
+        with self._lock:
+            return {'tracked': len(self._seen), 'pending_writes': len(self._dirty)}
+
+device_presence = DevicePresence()
+
+# Background leader election
+class BackgroundLeader:
+    """Elects one process to run the sync drain and retention, so gunicorn workers do not
+    compete for the same rows or multiply polling. On PostgreSQL the leader holds a session
+    advisory lock on a dedicated connection, elsewhere an exclusive lock on BACKGROUND_LOCK_FILE.
+    A leader that dies releases the lock with its connection or file, and a follower takes
+    over on its next attempt."""
+    LOCK_ID = int.from_bytes(hashlib.sha256(b'pos_background_leader').digest()[:8], 'big', signed=True)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._file = None
+        self._wake_mtime = None
+        self.active = False  # True once this process runs background threads
+        self.is_leader = False
+        self.since = None
+    
+    @property
+    def uses_file(self):
+        return db.engine.dialect.name != 'postgresql'
+    
+    def try_acquire(self):
+        """Become the leader if nobody is, returns True while this process leads"""
+        with self._lock:
+            if self.is_leader:
+                if self._still_held():
+                    return True
+                self._release()
+            acquired = self._acquire_file() if self.uses_file else self._acquire_advisory()
+            if acquired:
+                self.is_leader = True
+                self.since = datetime.utcnow()
+                self.signalled()  # Earlier signals are covered by the first drain
+                logger.info(f"Process {os.getpid()} is now the background leader")
+            return acquired
+    
+    def _acquire_advisory(self):
+        try:
+            # Detached from the pool: the lock lives exactly as long as this connection
+            raw = db.engine.raw_connection()
+            raw.detach()
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.LOCK_ID,))
+                acquired = cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Leader election failed: {str(e)}")
+            return False
+        if acquired:
+            self._conn = conn
+        else:
+            conn.close()
+        return acquired
+    
+    def _acquire_file(self):
+        try:
+            import fcntl
+        except ImportError:
+            # No flock (Windows): assume a single process
+            return True
+        handle = open(app.config['BACKGROUND_LOCK_FILE'], 'a+')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(f"{os.getpid()}\n")
+        handle.flush()
+        self._file = handle
+        return True
+    
+    def _still_held(self):
+        """A broken advisory-lock connection means another process may already lead"""
+        if self._conn is None:
+            return True
+        try:
+            with self._conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.error(f"Lost background leadership: {str(e)}")
+            return False
+    
+    def _release(self):
+        for handle in (self._conn, self._file):
+            if handle is not None:
+                try:
+                    handle.close()
+                except Exception:
+                    pass
+        self._conn = self._file = None
+        self.is_leader = False
+        self.since = None
+    
+    def signal(self):
+        """Tell a leader in another process about committed sync work when there is no NOTIFY"""
+        if self.active and not self.is_leader and self.uses_file:
+            try:
+                with open(app.config['BACKGROUND_LOCK_FILE'] + '.wake', 'a'):
+                    pass
+                os.utime(app.config['BACKGROUND_LOCK_FILE'] + '.wake')
+            except OSError as e:
+                logger.error(f"Error signalling the background leader: {str(e)}")
+    
+    def signalled(self):
+        """True if a follower signalled since the last call (one stat, no database access)"""
+        try:
+            mtime = os.stat(app.config['BACKGROUND_LOCK_FILE'] + '.wake').st_mtime_ns
+        except OSError:
+            mtime = 0
+        changed = self._wake_mtime is not None and mtime != self._wake_mtime
+        self._wake_mtime = mtime
+        return changed
+    
+    def stats(self):
+        return {
+            'active': self.active,
+            'is_leader': self.is_leader,
+            'pid': os.getpid(),
+            'method': 'file' if self.uses_file else 'advisory_lock',
+            'since': self.since.isoformat() if self.since else None
+        }
+
+background_leader = BackgroundLeader()
+
+# Sync wakeups
+class SyncWakeup:
+    """Wakes the background drain when sync work is committed.
+    On PostgreSQL, NOTIFY reaches the listener in every process. Elsewhere a condition
+    variable wakes the drain in this process."""
+    CHANNEL = 'pos_sync_queue'
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._signalled = False
+        self._listen_conn = None
+    
+    def notify_local(self):
+        with self._cond:
+            self._signalled = True
+            self._cond.notify_all()
+    
+    def wait(self, timeout):
+        """Block until work is signalled or timeout seconds pass, returns True if signalled"""
+        if db.engine.dialect.name == 'postgresql':
+            signalled = self._wait_notify(timeout)
+        else:
+            signalled = None
+        if signalled is None and background_leader.active and background_leader.uses_file:
+            # Followers in other processes touch the wake file, check it once a second
+            deadline = time.monotonic() + timeout
+            with self._cond:
+                while True:
+                    if self._signalled or background_leader.signalled():
+                        signalled = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        signalled = False
+                        break
+                    self._cond.wait(min(1.0, remaining))
+                self._signalled = False
+        elif signalled is None:
+            with self._cond:
+                self._cond.wait_for(lambda: self._signalled, timeout)
+                signalled, self._signalled = self._signalled, False
+        SYNC_WAKEUPS.inc('notify' if signalled else 'poll')
+        return signalled
+    
+    def _listener(self):
+        if self._listen_conn is None:
+            # Detached from the pool so the listener never holds a pooled slot
+            raw = db.engine.raw_connection()
+            raw.detach()
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.CHANNEL}")
+            self._listen_conn = conn
+        return self._listen_conn
+    
+    def _wait_notify(self, timeout):
+        """Wait on the LISTEN socket (psycopg2), None if the listener is unavailable"""
+        try:
+            conn = self._listener()
+            if not conn.notifies and select.select([conn], [], [], timeout) == ([], [], []):
+                return False
+            conn.poll()
+            signalled = bool(conn.notifies)
+            conn.notifies.clear()
+            return signalled
+        except Exception as e:
+            logger.error(f"Sync listener error, falling back to polling: {str(e)}")
+            if self._listen_conn is not None:
+                try:
+                    self._listen_conn.close()
+                except Exception:
+                    pass
+                self._listen_conn = None
+            return None
+
+sync_wakeup = SyncWakeup()
+
+def request_sync_wakeup(session=None):
+    """Wake the background drain once the current transaction commits"""
+    (session or db.session).info['sync_wakeup'] = True
+
+@event.listens_for(db.session, 'before_commit')
+def _send_sync_notify(session):
+    # NOTIFY is transactional, listeners only hear it if the queue rows commit
+    if session.in_nested_transaction():
+        return
+    if session.info.get('sync_wakeup') and db.engine.dialect.name == 'postgresql':
+        session.execute(db.text(f"NOTIFY {SyncWakeup.CHANNEL}"))
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_sync(session):
+    # The drain must not look for the rows before the outer transaction commits them
+    if session.in_nested_transaction():
+        return
+    if session.info.pop('sync_wakeup', None):
+        sync_wakeup.notify_local()
+        background_leader.signal()
+
+# Per-device pending counters
+class SyncPendingCounters:
+    """Count of sync rows still to apply (pending or retry) per device, so status polls never
+    read sync_queue. Deltas are applied when the writing transaction commits. The counters live
+    in this process, or in a Redis hash shared by every worker when SYNC_COUNTERS_REDIS_URL is set.
+    A reconciliation recounts them from the table every SYNC_COUNTER_RECONCILE_SECONDS.
+    In-process counters only see the drains of their own process. Only the background leader
+    drains, so a follower without Redis would keep counting applied items until its next
+    reconciliation; followers therefore count the device's rows from sync_queue instead.
+    That count reads idx_sync_queue_device_status, one index range per poll, so it stays cheap
+    on a large queue but is still a query; with several workers, set a Redis URL."""
+    KEY = 'pos:sync_pending'
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._redis = None
+        self.reconciled_at = None
+        self.last_reconcile = None
+        self.background = False  # True once the background reconciler runs in this process
+    
+    def _client(self):
+        url = app.config['SYNC_COUNTERS_REDIS_URL']
+        if not url or url.startswith('memory://'):
+            return None
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(url, socket_timeout=2)
+        return self._redis
+    
+    def apply(self, deltas):
+        """Add {device_id: delta} onto the counters"""
+        client = self._client()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for device_id, delta in deltas.items():
+                    if delta:
+                        pipe.hincrby(self.KEY, device_id, delta)
+                pipe.execute()
+            except Exception as e:
+                # A lost delta is repaired by the next reconciliation, which this forces
+                logger.error(f"Error updating pending sync counters: {str(e)}")
+                self.reconciled_at = None
+            return
+        with self._lock:
+            for device_id, delta in deltas.items():
+                self._counts[device_id] = self._counts.get(device_id, 0) + delta
+    
+    def get(self, device_id):
+        """Items still to sync for a device"""
+        # The background reconciler keeps the counters fresh, without it (serverless) reads do
+        if self.reconciled_at is None or (not self.background and time.monotonic() - self.reconciled_at >= app.config['SYNC_COUNTER_RECONCILE_SECONDS']):
+            self.reconcile()
+        key = device_id or ''
+        client = self._client()
+        if client is None and background_leader.active and not background_leader.is_leader:
+            return self._count_device(device_id)
+        if client is not None:
+            try:
+                return max(0, int(client.hget(self.KEY, key) or 0))
+            except Exception as e:
+                logger.error(f"Error reading pending sync counters: {str(e)}")
+                self.reconciled_at = None
+                return 0
+        with self._lock:
+            return max(0, self._counts.get(key, 0))
+    
+    def _count_device(self, device_id):
+        """Items still to sync for a device, counted from sync_queue"""
+        return db.session.query(func.count(SyncQueue.id)).filter(
+            SyncQueue.device_id == device_id if device_id else SyncQueue.device_id.is_(None),
+            SyncQueue.status.in_(['pending', 'retry'])
+        ).scalar()
+    
+    def reconcile(self):
+        """Recount every device from sync_queue and replace the counters, returns stats for the run"""
+        rows = db.session.query(SyncQueue.device_id, func.count(SyncQueue.id)).filter(
+            SyncQueue.status.in_(['pending', 'retry'])
+        ).group_by(SyncQueue.device_id).all()
+        db.session.commit()  # End the read transaction, this may run on the background thread
+        counts = {device_id or '': count for device_id, count in rows}
+        
+        client = self._client()
+        if client is not None:
+            try:
+                before = {key.decode(): int(value) for key, value in client.hgetall(self.KEY).items()}
+                pipe = client.pipeline(transaction=True)
+                pipe.delete(self.KEY)
+                if counts:
+                    pipe.hset(self.KEY, mapping=counts)
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Error reconciling pending sync counters: {str(e)}")
+                return None
+        else:
+            with self._lock:
+                before, self._counts = self._counts, counts
+        
+        drift = sum(abs(counts.get(key, 0) - before.get(key, 0)) for key in set(counts) | set(before))
+        # The first reconciliation in a process only seeds the counters
+        if drift and self.reconciled_at is not None:
+            SYNC_COUNTER_DRIFT.inc(amount=drift)
+            logger.warning(f"Pending sync counters drifted by {drift}, reconciled {len(counts)} devices")
+        self.reconciled_at = time.monotonic()
+        self.last_reconcile = {
+            'devices': len(counts),
+            'pending': sum(counts.values()),
+            'drift': drift,
+            'finished_at': datetime.utcnow().isoformat()
+        }
+        return self.last_reconcile
+
+sync_counters = SyncPendingCounters()
+
+def count_pending(device_id, delta):
+    """Adjust a device's pending sync counter when the current transaction commits"""
+    pending = db.session.info.setdefault('sync_pending', {})
+    key = device_id or ''
+    pending[key] = pending.get(key, 0) + delta
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_pending_counts(session):
+    # Releasing a savepoint also fires after_commit, the counters wait for the real commit
+    if session.in_nested_transaction():
+        return
+    deltas = session.info.pop('sync_pending', None)
+    if deltas:
+        sync_counters.apply(deltas)
+
 # Sync Engine
 class SyncEngine:
     def __init__(self):
         self.sync_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
         self.is_syncing = False
+        self.last_run = None
+        self.totals = {'processed': 0, 'failed': 0, 'dead_lettered': 0, 'batches': 0, 'runs': 0}
+        self._executor = None
+        self._drain_scheduled = False
     
     def queue_for_sync(self, entity_type, entity_id, operation, data, device_id=None):
         """Add item to sync queue"""
@@ -207,6 +1818,8 @@ class SyncEngine:
                 status='pending'
             )
             db.session.add(sync_item)
+            count_pending(device_id, 1)
+            request_sync_wakeup()
             db.session.commit()
             logger.info(f"Queued {operation} for {entity_type} {entity_id}")
             return True
@@ -215,103 +1828,453 @@ class SyncEngine:
             db.session.rollback()
             return False
     
-    def process_sync_queue(self):
-        """Process pending sync items"""
-        if self.is_syncing:
+    def queue_many(self, items, job_id=None, commit=True):
+        """Add many items to the sync queue with one bulk insert, committing unless told not to"""
+        if not items:
+            return 0
+        now = datetime.utcnow()
+        rows = [{
+            'id': new_id(),
+            'entity_type': item['entity_type'],
+            'entity_id': item['entity_id'],
+            'operation': item['operation'],
+            'data': item['data'],
+            'device_id': item.get('device_id'),
+            'job_id': job_id,
+            'status': 'pending',
+            'retry_count': 0,
+            'created_at': now,
+            'updated_at': now
+        } for item in items]
+        
+        # A list of parameter sets runs as executemany (batched VALUES on psycopg2)
+        db.session.execute(SyncQueue.__table__.insert(), rows)
+        for row in rows:
+            count_pending(row['device_id'], 1)
+        request_sync_wakeup()
+        if commit:
+            db.session.commit()
+        logger.info(f"Queued {len(rows)} items for sync (job {job_id})")
+        return len(rows)
+    
+    def schedule_drain(self):
+        """Drain the queue on a background thread, coalescing repeated requests"""
+        # With background threads running, the commit already woke the elected leader's drain
+        if background_leader.active:
             return
+        with self.stats_lock:
+            if self._drain_scheduled:
+                return
+            self._drain_scheduled = True
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sync-drain')
+        self._executor.submit(self._background_drain)
+    
+    def _background_drain(self):
+        with self.stats_lock:
+            self._drain_scheduled = False
+        with app.app_context():
+            try:
+                self.process_sync_queue()
+            except Exception as e:
+                logger.error(f"Background drain error: {str(e)}")
+    
+    def job_status(self, job_id):
+        """Summarize the queue rows written by one push, or None if unknown"""
+        counts = dict(db.session.query(
+            SyncQueue.status,
+            func.count(SyncQueue.id)
+        ).filter(SyncQueue.job_id == job_id).group_by(SyncQueue.status).all())
+        dead = SyncDeadLetter.query.filter_by(job_id=job_id).count()
+        
+        if not counts and not dead:
+            return None
         
-        with self.sync_lock:
-            self.is_syncing = True
+        total = sum(counts.values()) + dead
+        failed = counts.get('failed', 0) + dead
+        done = counts.get('completed', 0) + failed
+        return {
+            'job_id': job_id,
+            'status': 'completed' if done == total else 'processing',
+            'total': total,
+            'pending': counts.get('pending', 0) + counts.get('processing', 0) + counts.get('retry', 0),
+            'retrying': counts.get('retry', 0),
+            'completed': counts.get('completed', 0),
+            'failed': failed
+        }
+    
+    def seconds_until_next_retry(self, limit):
+        """Seconds until the earliest scheduled retry is due, capped at limit"""
+        due = db.session.query(func.min(SyncQueue.next_attempt_at)).filter(SyncQueue.status == 'retry').scalar()
+        db.session.commit()  # End the read transaction before the drain sleeps
+        if due is None:
+            return limit
+        return max(0.0, min(limit, (due - datetime.utcnow()).total_seconds()))
+    
+    def _supports_skip_locked(self):
+        """Only PostgreSQL can hand out disjoint batches to concurrent workers"""
+        return db.engine.dialect.name == 'postgresql'
+    
+    def claim_batch(self, batch_size):
+        """Lock up to batch_size pending items plus a few due retries, skipping rows held by other workers"""
+        items = SyncQueue.query.filter_by(status='pending').order_by(
+            SyncQueue.created_at
+        ).limit(batch_size).with_for_update(skip_locked=True).all()
+        
+        # Retries get their own small quota so a backlog of failing rows never crowds out fresh work
+        retry_quota = app.config['SYNC_RETRY_BATCH_SIZE']
+        if retry_quota > 0:
+            items += SyncQueue.query.filter(
+                SyncQueue.status == 'retry',
+                SyncQueue.next_attempt_at <= datetime.utcnow()
+            ).order_by(SyncQueue.next_attempt_at).limit(retry_quota).with_for_update(skip_locked=True).all()
+        return items
+    
+    def retry_delay(self, attempt):
+        """Exponential backoff with jitter: half the capped delay plus a random share of the other half"""
+        delay = min(app.config['SYNC_RETRY_MAX_SECONDS'], app.config['SYNC_RETRY_BASE_SECONDS'] * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+    
+    def _fail_item(self, item, error, now):
+        """Schedule the next attempt, or move the item to the dead-letter table once retries run out.
+        Returns True if the item was dead-lettered."""
+        item.retry_count = (item.retry_count or 0) + 1
+        item.last_error = error[:2000]
+        if item.retry_count < app.config['SYNC_MAX_RETRIES']:
+            item.status = 'retry'
+            item.next_attempt_at = now + timedelta(seconds=self.retry_delay(item.retry_count))
+            return False
+        
+        db.session.add(SyncDeadLetter(
+            id=item.id,
+            entity_type=item.entity_type,
+            entity_id=item.entity_id,
+            operation=item.operation,
+            data=item.data,
+            device_id=item.device_id,
+            job_id=item.job_id,
+            retry_count=item.retry_count,
+            last_error=item.last_error,
+            created_at=item.created_at,
+            failed_at=now
+        ))
+        db.session.delete(item)
+        logger.warning(f"Dead-lettered {item.entity_type} {item.entity_id} after {item.retry_count} attempts")
+        return True
+    
+    def _apply_item(self, item):
+        """Apply a single queued change to the cloud tables"""
+        if item.entity_type == 'order':
+            self._sync_order(item)
+        elif item.entity_type == 'product':
+            self._sync_product(item)
+        elif item.entity_type == 'inventory':
+            self._sync_inventory(item)
+    
+    def _requeue_filters(self, model, ids, job_id, entity_type, device_id):
+        filters = []
+        if ids:
+            filters.append(model.id.in_(ids))
+        if job_id:
+            filters.append(model.job_id == job_id)
+        if entity_type:
+            filters.append(model.entity_type == entity_type)
+        if device_id:
+            filters.append(model.device_id == device_id)
+        return filters
+    
+    def requeue_dead_letters(self, ids=None, job_id=None, entity_type=None, device_id=None):
+        """Move matching dead letters back to pending with one INSERT ... SELECT and one DELETE.
+        Older 'failed' queue rows matching the same filters are reset in place. Returns the count."""
+        filters = self._requeue_filters(SyncDeadLetter, ids, job_id, entity_type, device_id)
+        queue_filters = self._requeue_filters(SyncQueue, ids, job_id, entity_type, device_id)
+        now = datetime.utcnow()
+        
+        # Counted before the rows move, for the per-device pending counters
+        by_device = db.session.query(SyncDeadLetter.device_id, func.count(SyncDeadLetter.id)).filter(
+            *filters
+        ).group_by(SyncDeadLetter.device_id).all()
+        by_device += db.session.query(SyncQueue.device_id, func.count(SyncQueue.id)).filter(
+            SyncQueue.status == 'failed', *queue_filters
+        ).group_by(SyncQueue.device_id).all()
+
+        columns = ['id', 'entity_type', 'entity_id', 'operation', 'data', 'device_id', 'job_id',
+                   'status', 'retry_count', 'created_at', 'updated_at']
+        rows = db.select(
+            SyncDeadLetter.id, SyncDeadLetter.entity_type, SyncDeadLetter.entity_id,
+            SyncDeadLetter.operation, SyncDeadLetter.data, SyncDeadLetter.device_id, SyncDeadLetter.job_id,
+            db.literal('pending'), db.literal(0), SyncDeadLetter.created_at, db.literal(now, db.DateTime)
+        ).where(*filters)
+        requeued = db.session.execute(SyncQueue.__table__.insert().from_select(columns, rows)).rowcount
+        db.session.execute(db.delete(SyncDeadLetter).where(*filters))
+        
+        requeued += SyncQueue.query.filter(
+            SyncQueue.status == 'failed',
+            *queue_filters
+        ).update({'status': 'pending', 'retry_count': 0, 'next_attempt_at': None, 'updated_at': now},
+                 synchronize_session=False)
+        for device, count in by_device:
+            count_pending(device, count)
+        if requeued:
+            request_sync_wakeup()
+        db.session.commit()
+        
+        logger.info(f"Requeued {requeued} failed sync items")
+        return requeued
+    
+    def process_batch(self, batch_size):
+        """Claim and apply one batch in a single transaction, returns (processed, failed, dead_lettered)"""
+        items = self.claim_batch(batch_size)
+        processed = failed = dead_lettered = 0
+        finished = {}  # device_id -> items that left the pending count
+        now = datetime.utcnow()
+        
+        # Contiguous runs of order creates are ingested together, each run just before its first item
+        # so an earlier inventory or product row is still applied ahead of the orders that follow it
+        ingested = {}
+        run_end = 0
+        for index, item in enumerate(items):
+            if index >= run_end and self._is_order_create(item):
+                run_end = index
+                while run_end < len(items) and self._is_order_create(items[run_end]):
+                    run_end += 1
+                ingested.update(self._ingest_run(items[index:run_end]))
             try:
-                pending_items = SyncQueue.query.filter_by(status='pending').order_by('created_at').limit(50).all()
-                
-                for item in pending_items:
-                    try:
-                        item.status = 'processing'
-                        db.session.commit()
-                        
-                        # Process based on entity type
-                        if item.entity_type == 'order':
-                            self._sync_order(item)
-                        elif item.entity_type == 'product':
-                            self._sync_product(item)
-                        elif item.entity_type == 'inventory':
-                            self._sync_inventory(item)
-                        
-                        item.status = 'completed'
-                        item.updated_at = datetime.utcnow()
-                        db.session.commit()
-                        
-                        logger.info(f"Successfully synced {item.entity_type} {item.entity_id}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error syncing {item.entity_type} {item.entity_id}: {str(e)}")
-                        item.status = 'failed'
-                        item.retry_count += 1
-                        db.session.commit()
-                
-                # Clean up old completed items
-                cutoff = datetime.utcnow() - timedelta(days=7)
-                SyncQueue.query.filter(
-                    and_(
-                        SyncQueue.status.in_(['completed', 'failed']),
-                        SyncQueue.updated_at < cutoff
-                    )
-                ).delete(synchronize_session=False)
-                db.session.commit()
-                
+                if item.id in ingested:
+                    if ingested[item.id]:
+                        raise ValueError(ingested[item.id])
+                else:
+                    # Savepoint per item so one bad row does not roll back the batch
+                    with db.session.begin_nested():
+                        self._apply_item(item)
+                item.status = 'completed'
+                item.next_attempt_at = None
+                finished[item.device_id] = finished.get(item.device_id, 0) + 1
+                processed += 1
+                logger.debug(f"Successfully synced {item.entity_type} {item.entity_id}")
             except Exception as e:
-                logger.error(f"Error in sync process: {str(e)}")
-            finally:
-                self.is_syncing = False
+                logger.error(f"Error syncing {item.entity_type} {item.entity_id}: {str(e)}")
+                failed += 1
+                if self._fail_item(item, str(e), now):
+                    finished[item.device_id] = finished.get(item.device_id, 0) + 1
+                    dead_lettered += 1
+                    continue
+            item.updated_at = now
+        
+        # Recorded after the per-item savepoints, once the outcome of every item is known
+        for device_id, count in finished.items():
+            count_pending(device_id, -count)
+        # Releases the row locks taken by claim_batch
+        db.session.commit()
+        return processed, failed, dead_lettered
+    
+    @staticmethod
+    def _is_order_create(item):
+        return item.entity_type == 'order' and item.operation == 'create'
+    
+    def _ingest_run(self, run):
+        """Ingest a run of order creates in one savepoint, returns {sync_item_id: error or None}.
+        Empty for a single order or a failed set, those are applied one by one."""
+        if len(run) < 2:
+            return {}
+        try:
+            with db.session.begin_nested():
+                failures = self.ingest_orders(run)
+        except Exception as e:
+            logger.warning(f"Batched order ingest failed, applying {len(run)} orders one by one: {str(e)}")
+            return {}
+        return {item.id: failures.get(item.id) for item in run}
+    
+    def _drain(self, batch_size, max_batches, totals):
+        """Keep claiming batches until the queue is empty or max_batches is reached"""
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            try:
+                processed, failed, dead_lettered = self.process_batch(batch_size)
+            except Exception as e:
+                logger.error(f"Error in sync batch: {str(e)}")
+                db.session.rollback()
+                break
+            
+            if not processed and not failed:
+                break
+            
+            batches += 1
+            with self.stats_lock:
+                totals['processed'] += processed
+                totals['failed'] += failed
+                totals['dead_lettered'] += dead_lettered
+                totals['batches'] += 1
+    
+    def _drain_worker(self, batch_size, max_batches, totals):
+        """Thread entry point, each worker gets its own app context and session"""
+        with app.app_context():
+            self._drain(batch_size, max_batches, totals)
+    
+    def process_sync_queue(self, batch_size=None, concurrency=None, max_batches=None):
+        """Drain pending sync items in batches, returns throughput stats for the run"""
+        batch_size = batch_size or app.config['SYNC_BATCH_SIZE']
+        concurrency = concurrency or app.config['SYNC_CONCURRENCY']
+        
+        # Without SKIP LOCKED concurrent drains would apply the same rows twice
+        exclusive = not self._supports_skip_locked()
+        if exclusive:
+            concurrency = 1
+            if not self.sync_lock.acquire(blocking=False):
+                SYNC_RUNS_SKIPPED.inc()
+                return None
+        
+        self.is_syncing = True
+        totals = {'processed': 0, 'failed': 0, 'dead_lettered': 0, 'batches': 0}
+        started = time.monotonic()
+        try:
+            if concurrency > 1:
+                workers = [
+                    threading.Thread(
+                        target=self._drain_worker,
+                        args=(batch_size, max_batches, totals),
+                        daemon=True
+                    )
+                    for _ in range(concurrency)
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            else:
+                self._drain(batch_size, max_batches, totals)
+        finally:
+            self.is_syncing = False
+            if exclusive:
+                self.sync_lock.release()
+        
+        return self._record_run(totals, time.monotonic() - started, batch_size, concurrency)
+    
+    def _record_run(self, totals, elapsed, batch_size, concurrency):
+        """Store and log drain throughput for the finished run"""
+        items = totals['processed'] + totals['failed']
+        run = {
+            'processed': totals['processed'],
+            'failed': totals['failed'],
+            'dead_lettered': totals['dead_lettered'],
+            'batches': totals['batches'],
+            'batch_size': batch_size,
+            'concurrency': concurrency,
+            'elapsed_seconds': round(elapsed, 3),
+            'items_per_second': round(items / elapsed, 1) if elapsed > 0 else 0.0,
+            'finished_at': datetime.utcnow().isoformat()
+        }
+        with self.stats_lock:
+            self.last_run = run
+            self.totals['runs'] += 1
+            for key in ('processed', 'failed', 'dead_lettered', 'batches'):
+                self.totals[key] += totals[key]
+        SYNC_ITEMS.inc('completed', amount=totals['processed'])
+        SYNC_ITEMS.inc('failed', amount=totals['failed'])
+        SYNC_ITEMS.inc('dead_lettered', amount=totals['dead_lettered'])
+        
+        if items:
+            logger.info(
+                f"Sync drained {items} items in {run['batches']} batches "
+                f"({run['items_per_second']} items/s, {concurrency} workers)"
+            )
+        return run
+    
+    def stats(self):
+        """Cumulative and last-run drain throughput"""
+        with self.stats_lock:
+            return {
+                'is_syncing': self.is_syncing,
+                'last_run': self.last_run,
+                'totals': dict(self.totals)
+            }
     
     def _sync_order(self, sync_item):
         """Sync order to cloud"""
-        order_data = sync_item.data
-        
-        # Check if order already exists
-        existing_order = Order.query.filter_by(id=order_data.get('id')).first()
-        
-        if sync_item.operation == 'create' and not existing_order:
-            # Create new order
-            order = Order(
-                id=order_data.get('id'),
-                order_number=order_data.get('order_number'),
-                total_amount=order_data.get('total_amount'),
-                tax_amount=order_data.get('tax_amount', 0),
-                discount_amount=order_data.get('discount_amount', 0),
-                status=order_data.get('status', 'completed'),
-                payment_method=order_data.get('payment_method'),
-                payment_status=order_data.get('payment_status', 'completed'),
-                customer_name=order_data.get('customer_name'),
-                customer_email=order_data.get('customer_email'),
-                customer_phone=order_data.get('customer_phone'),
-                is_online=False,  # This was created offline
-                device_id=sync_item.device_id,
-                sync_status='synced',
-                barcode_data=order_data.get('barcode_data'),
-                barcode_image=order_data.get('barcode_image'),
-                metadata_json=order_data.get('metadata', {}),
-                created_at=datetime.fromisoformat(order_data.get('created_at')) if order_data.get('created_at') else datetime.utcnow()
-            )
-            db.session.add(order)
-            
-            # Add order items
-            for item_data in order_data.get('items', []):
-                order_item = OrderItem(
-                    id=str(uuid.uuid4()),
-                    order_id=order_data.get('id'),
-                    product_id=item_data.get('product_id'),
-                    quantity=item_data.get('quantity'),
-                    unit_price=item_data.get('unit_price'),
-                    total_price=item_data.get('total_price'),
-                    product_name=item_data.get('product_name')
-                )
-                db.session.add(order_item)
-            
-            # Update inventory if needed
-            if order_data.get('status') == 'completed':
-                self._update_inventory_from_order(order_data.get('items', []))
+        if sync_item.operation == 'create':
+            error = self.ingest_orders([sync_item]).get(sync_item.id)
+            if error:
+                raise ValueError(error)
+    
+    def ingest_orders(self, sync_items):
+        """Insert offline orders, their items and inventory deltas with a handful of set-based statements.
+        Orders that already exist are skipped by ON CONFLICT DO NOTHING, so replaying a push is a no-op.
+        Returns {sync_item_id: error} for orders whose order_number belongs to a different order."""
+        now = datetime.utcnow()
+        orders = {}
+        for sync_item in sync_items:
+            order_data = sync_item.data
+            orders.setdefault(canonical_uuid(order_data.get('id')), (sync_item, order_data))
+        
+        order_rows = [{
+            'id': order_id,
+            'order_number': order_data.get('order_number'),
+            'total_amount': order_data.get('total_amount'),
+            'tax_amount': order_data.get('tax_amount', 0),
+            'discount_amount': order_data.get('discount_amount', 0),
+            'status': order_data.get('status', 'completed'),
+            'payment_method': order_data.get('payment_method'),
+            'payment_status': order_data.get('payment_status', 'completed'),
+            'customer_name': order_data.get('customer_name'),
+            'customer_email': order_data.get('customer_email'),
+            'customer_phone': order_data.get('customer_phone'),
+            'is_online': False,  # This was created offline
+            'device_id': sync_item.device_id,
+            'sync_status': 'synced',
+            'barcode_data': order_data.get('barcode_data'),
+            'metadata': order_data.get('metadata', {}),
+            'created_at': datetime.fromisoformat(order_data['created_at']) if order_data.get('created_at') else now,
+            'updated_at': now
+        } for order_id, (sync_item, order_data) in orders.items()]
+        
+        # Conflicts on either the id or the order_number skip the row instead of failing the batch
+        stmt = _dialect_insert(db.session, Order.__table__).on_conflict_do_nothing().returning(Order.__table__.c.id)
+        inserted = set(db.session.execute(stmt, order_rows).scalars())
+        
+        failures = {}
+        skipped = [order_id for order_id in orders if order_id not in inserted]
+        if skipped:
+            existing = set(db.session.execute(db.select(Order.id).where(Order.id.in_(skipped))).scalars())
+            for order_id in skipped:
+                if order_id not in existing:
+                    sync_item, order_data = orders[order_id]
+                    failures[sync_item.id] = f"order_number {order_data.get('order_number')} belongs to another order"
+        if not inserted:
+            return failures
+        
+        rows_by_id = {row['id']: row for row in order_rows}
+        item_rows = []
+        deltas = {}
+        for order_id in inserted:
+            order_row = rows_by_id[order_id]
+            for item_data in orders[order_id][1].get('items', []):
+                item_rows.append({
+                    'id': new_id(),
+                    'order_id': order_id,
+                    'product_id': item_data.get('product_id'),
+                    'quantity': item_data.get('quantity'),
+                    'unit_price': item_data.get('unit_price'),
+                    'total_price': item_data.get('total_price'),
+                    'product_name': item_data.get('product_name'),
+                    'created_at': now
+                })
+                if order_row['status'] == 'completed':
+                    product_id = canonical_uuid(item_data.get('product_id'))
+                    deltas[product_id] = deltas.get(product_id, 0) + (item_data.get('quantity') or 0)
+        
+        if item_rows:
+            db.session.execute(OrderItem.__table__.insert(), item_rows)
+        
+        # One UPDATE for the whole batch, each product decremented once by its summed quantity
+        self.apply_inventory_deltas(deltas)
+        
+        # Recorded last so a failed statement above leaves nothing behind for commit
+        for order_id in inserted:
+            order_row = rows_by_id[order_id]
+            record_change('order', order_id, order_row['device_id'])
+            if order_row['status'] == 'completed':
+                record_sale(order_row['created_at'], order_row['device_id'], False, order_row['total_amount'])
+        return failures
     
     def _sync_product(self, sync_item):
         """Sync product updates"""
@@ -331,11 +2294,13 @@ class SyncEngine:
                 image_url=product_data.get('image_url')
             )
             db.session.add(product)
+            mark_catalog_changed(product.id)
         elif sync_item.operation == 'update' and existing_product:
             for key, value in product_data.items():
                 if key != 'id' and hasattr(existing_product, key):
                     setattr(existing_product, key, value)
             existing_product.updated_at = datetime.utcnow()
+            mark_catalog_changed(existing_product.id)
     
     def _sync_inventory(self, sync_item):
         """Sync inventory changes"""
@@ -346,93 +2311,335 @@ class SyncEngine:
             if sync_item.operation == 'update':
                 product.inventory_count = inventory_data.get('new_count', product.inventory_count)
                 product.updated_at = datetime.utcnow()
+                mark_catalog_changed(product.id)
     
-    def _update_inventory_from_order(self, items):
-        """Update inventory counts from order items"""
-        for item in items:
-            product = Product.query.filter_by(id=item.get('product_id')).first()
-            if product and product.inventory_count is not None:
-                product.inventory_count -= item.get('quantity', 0)
-                product.updated_at = datetime.utcnow()
+    def apply_inventory_deltas(self, deltas):
+        """Subtract {product_id: quantity} from inventory in one atomic UPDATE.
+        Returns {product_id: new_count} for the products that track inventory."""
+        # Sorted by product id so concurrent baskets like [A, B] and [B, A] lock rows in the
+        # same order instead of deadlocking, as the ORM flush did with its primary-key order
+        deltas = dict(sorted((product_id, quantity) for product_id, quantity in deltas.items() if product_id and quantity))
+        if not deltas:
+            return {}
+        
+        if db.engine.dialect.name == 'postgresql':
+            # UPDATE products ... FROM (VALUES ...) AS deltas
+            delta_rows = values(
+                column('product_id', UUIDType),
+                column('quantity', db.Integer),
+                name='deltas'
+            ).data(list(deltas.items()))
+            stmt = update(Product).where(Product.id == delta_rows.c.product_id).values(
+                inventory_count=Product.inventory_count - delta_rows.c.quantity,
+                updated_at=datetime.utcnow()
+            )
+        else:
+            # Same single statement for databases without UPDATE ... FROM (VALUES ...)
+            stmt = update(Product).where(Product.id.in_(list(deltas))).values(
+                inventory_count=Product.inventory_count - case(
+                    *[(Product.id == product_id, quantity) for product_id, quantity in deltas.items()], else_=0
+                ),
+                updated_at=datetime.utcnow()
+            )
+        
+        stmt = stmt.where(Product.inventory_count.isnot(None)).returning(Product.id, Product.inventory_count)
+        new_counts = dict(db.session.execute(stmt.execution_options(synchronize_session=False)).all())
+        if new_counts:
+            mark_catalog_changed(*new_counts)
+        return new_counts
     
-    def pull_updates(self, device_id, last_sync):
-        """Pull updates from cloud for a device"""
+    def start_seq_for(self, last_sync):
+        """Translate a legacy last_sync timestamp into a change log position"""
+        first_seq = db.session.query(func.min(ChangeLog.seq)).filter(ChangeLog.created_at > last_sync).scalar()
+        if first_seq is None:
+            return self._head_seq()
+        return first_seq - 1
+    
+    def _head_seq(self):
+        return db.session.query(ChangeLogState.last_seq).filter(ChangeLogState.id == 1).scalar() or 0
+    
+    def pull_updates(self, device_id, after_seq, max_rows=None, max_bytes=None):
+        """Pull one page of changes after after_seq for a device.
+        Returns (updates, next_seq, has_more)."""
+        max_rows = max_rows or app.config['SYNC_PULL_PAGE_ROWS']
+        max_bytes = max_bytes or app.config['SYNC_PULL_PAGE_BYTES']
         updates = {
             'products': [],
             'orders': [],
             'inventory': []
         }
         
-        # Get updated products since last sync
-        updated_products = Product.query.filter(
-            Product.updated_at > last_sync,
-            Product.online_sync == True
-        ).all()
-        
-        for product in updated_products:
-            updates['products'].append({
-                'id': product.id,
-                'name': product.name,
-                'price': product.price,
-                'category': product.category,
-                'sku': product.sku,
-                'inventory_count': product.inventory_count,
-                'is_available': product.is_available,
-                'operation': 'update'  # or 'create' based on device's local state
-            })
+        # Read the head first: everything up to it is committed, so an empty
+        # or short page can advance the cursor past other devices' filtered rows
+        head_seq = self._head_seq()
+        entries = ChangeLog.query.filter(
+            ChangeLog.seq > after_seq,
+            ChangeLog.seq <= head_seq,
+            # Orders from other devices only
+            or_(
+                ChangeLog.entity_type != 'order',
+                ChangeLog.device_id.is_(None),
+                ChangeLog.device_id != device_id
+            )
+        ).order_by(ChangeLog.seq).limit(max_rows).all()
         
-        # Get new orders that might affect inventory
-        new_orders = Order.query.filter(
-            Order.created_at > last_sync,
-            Order.device_id != device_id,  # Orders from other devices
-            Order.status == 'completed'
-        ).limit(100).all()
+        product_ids = {e.entity_id for e in entries if e.entity_type == 'product'}
+        order_ids = {e.entity_id for e in entries if e.entity_type == 'order'}
+        products = {}
+        orders = {}
         
-        for order in new_orders:
-            updates['orders'].append({
-                'id': order.id,
-                'order_number': order.order_number,
-                'status': order.status
-            })
+        if product_ids:
+            for product in db.session.query(
+                Product.id,
+                Product.name,
+                Product.price,
+                Product.category,
+                Product.sku,
+                Product.inventory_count,
+                Product.is_available
+            ).filter(Product.id.in_(product_ids), Product.online_sync == True):
+                products[product.id] = {
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'category': product.category,
+                    'sku': product.sku,
+                    'inventory_count': product.inventory_count,
+                    'is_available': product.is_available,
+                    'operation': 'update'  # or 'create' based on device's local state
+                }
+        
+        if order_ids:
+            for order in db.session.query(
+                Order.id,
+                Order.order_number,
+                Order.status
+            ).filter(Order.id.in_(order_ids), Order.status == 'completed'):
+                orders[order.id] = {
+                    'id': order.id,
+                    'order_number': order.order_number,
+                    'status': order.status
+                }
         
-        return updates
+        # Emit in seq order until the byte budget is spent, each entity once
+        next_seq = after_seq
+        size = 0
+        seen = set()
+        for entry in entries:
+            key = (entry.entity_type, entry.entity_id)
+            record = products.get(entry.entity_id) if entry.entity_type == 'product' else orders.get(entry.entity_id)
+            if record is not None and key not in seen:
+                record_size = len(json.dumps(record, default=str))
+                if size and size + record_size > max_bytes:
+                    return updates, next_seq, True
+                updates['products' if entry.entity_type == 'product' else 'orders'].append(record)
+                seen.add(key)
+                size += record_size
+            next_seq = entry.seq
+        
+        if len(entries) < max_rows:
+            # A lagging replica may be behind a cursor the primary handed out, never move it back
+            return updates, max(head_seq, after_seq), False
+        return updates, next_seq, True
 
 # Initialize sync engine
 sync_engine = SyncEngine()
 
+class ChangeFeed:
+    """Lets long-polls and event streams wait for change_log entries. Commits in this process
+    wake waiters at once, commits in other processes are noticed by re-reading the head seq
+    every SYNC_WATCH_POLL_MS."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self.waiting = 0
+    
+    def notify(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+    
+    def wait_for_updates(self, device_id, after_seq, timeout, max_rows=None, max_bytes=None):
+        """Block until there are updates for the device after after_seq, or timeout seconds pass.
+        Returns (updates, next_seq, has_more) like pull_updates, with empty updates on timeout."""
+        deadline = time.monotonic() + timeout
+        poll = app.config['SYNC_WATCH_POLL_MS'] / 1000
+        with self._cond:
+            self.waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    version = self._version
+                if sync_engine._head_seq() > after_seq:
+                    updates, after_seq, has_more = sync_engine.pull_updates(device_id, after_seq, max_rows, max_bytes)
+                    # A page of other devices' filtered entries only moves the cursor on
+                    if has_more or any(updates.values()):
+                        return updates, after_seq, has_more
+                db.session.commit()  # Hand the connection back while waiting
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {'products': [], 'orders': [], 'inventory': []}, after_seq, False
+                with self._cond:
+                    self._cond.wait_for(lambda: self._version != version, min(poll, remaining))
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+change_feed = ChangeFeed()
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_change_feed(session):
+    if session.in_nested_transaction():
+        return
+    if session.info.pop('changes_written', None):
+        change_feed.notify()
+
+class SyncRetention:
+    """Removes finished sync_queue rows in small keyset batches, optionally archiving them first.
+    Each batch is its own short transaction, so locks and WAL stay bounded and draining
+    continues between batches."""
+    FINISHED = ('completed', 'failed')
+    ARCHIVE_FIELDS = ('id', 'entity_type', 'entity_id', 'operation', 'data', 'device_id', 'job_id',
+                      'status', 'retry_count', 'last_error', 'created_at', 'updated_at')
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_run = None
+    
+    def _archive_path(self, archive_dir):
+        os.makedirs(archive_dir, exist_ok=True)
+        return os.path.join(archive_dir, f"sync_queue-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.ndjson.gz")
+    
+    def _archive_line(self, row):
+        record = {field: getattr(row, field) for field in self.ARCHIVE_FIELDS}
+        for field in ('created_at', 'updated_at'):
+            record[field] = record[field].isoformat() if record[field] else None
+        return json.dumps(record, separators=(',', ':')) + '\n'
+    
+    def run(self, older_than_days=None, batch_size=None, archive_dir=None, max_batches=None):
+        """Delete finished rows older than the cutoff, returns stats for the run or None if one is running"""
+        if not self.lock.acquire(blocking=False):
+            return None
+        
+        older_than_days = app.config['SYNC_RETENTION_DAYS'] if older_than_days is None else older_than_days
+        batch_size = batch_size or app.config['SYNC_RETENTION_BATCH_SIZE']
+        archive_dir = app.config['SYNC_ARCHIVE_DIR'] if archive_dir is None else archive_dir
+        pause = app.config['SYNC_RETENTION_PAUSE_MS'] / 1000
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        skip_locked = sync_engine._supports_skip_locked()
+        
+        started = time.monotonic()
+        deleted = batches = 0
+        archive_path = archive = None
+        last_key = None
+        try:
+            while max_batches is None or batches < max_batches:
+                query = SyncQueue.query.filter(
+                    SyncQueue.status.in_(self.FINISHED),
+                    SyncQueue.updated_at < cutoff
+                )
+                if last_key:
+                    # Keyset pagination: resume after the last row seen instead of rescanning
+                    query = query.filter(or_(
+                        SyncQueue.updated_at > last_key[0],
+                        and_(SyncQueue.updated_at == last_key[0], SyncQueue.id > last_key[1])
+                    ))
+                query = query.order_by(SyncQueue.updated_at, SyncQueue.id).limit(batch_size)
+                if skip_locked:
+                    query = query.with_for_update(skip_locked=True)
+                
+                if archive_dir:
+                    rows = query.all()
+                    ids = [row.id for row in rows]
+                    keys = [(row.updated_at, row.id) for row in rows]
+                else:
+                    keys = query.with_entities(SyncQueue.updated_at, SyncQueue.id).all()
+                    ids = [key[1] for key in keys]
+                if not ids:
+                    db.session.commit()
+                    break
+                
+                if archive_dir:
+                    if archive is None:
+                        archive_path = self._archive_path(archive_dir)
+                        archive = gzip.open(archive_path, 'wt', encoding='utf-8')
+                    archive.writelines(self._archive_line(row) for row in rows)
+                    archive.flush()
+                    SYNC_RETENTION_ROWS.inc('archived', amount=len(rows))
+                
+                db.session.execute(db.delete(SyncQueue).where(SyncQueue.id.in_(ids)))
+                db.session.commit()
+                deleted += len(ids)
+                batches += 1
+                last_key = keys[-1]
+                SYNC_RETENTION_ROWS.inc('deleted', amount=len(ids))
+                
+                if len(ids) < batch_size:
+                    break
+                if pause:
+                    time.sleep(pause)
+        except Exception as e:
+            logger.error(f"Sync retention error: {str(e)}")
+            db.session.rollback()
+        finally:
+            if archive is not None:
+                archive.close()
+            self.lock.release()
+        
+        elapsed = time.monotonic() - started
+        SYNC_RETENTION_SECONDS.observe(elapsed)
+        self.last_run = {
+            'deleted': deleted,
+            'batches': batches,
+            'cutoff': cutoff.isoformat(),
+            'archive': archive_path,
+            'elapsed_seconds': round(elapsed, 3),
+            'finished_at': datetime.utcnow().isoformat()
+        }
+        if deleted:
+            logger.info(f"Sync retention removed {deleted} rows in {batches} batches ({elapsed:.1f}s)")
+        return self.last_run
+
+sync_retention = SyncRetention()
+
+@app.cli.command('purge-sync-queue')
+def purge_sync_queue_command():
+    """Delete (and optionally archive) finished sync_queue rows past the retention period."""
+    logger.info(f"Sync retention: {sync_retention.run()}")
+
 # API Routes
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
 
 @app.route('/api/products', methods=['GET'])
+@read_replica
 def get_products():
     """Get all products with optional filtering"""
     category = request.args.get('category')
     available_only = request.args.get('available_only', 'false').lower() == 'true'
     
-    query = Product.query
-    
-    if category:
-        query = query.filter_by(category=category)
-    
-    if available_only:
-        query = query.filter_by(is_available=True)
-    
-    products = query.order_by(Product.name).all()
+    version = current_catalog_version()
+    if request.if_none_match.contains(CatalogCache.etag(version, category, available_only)):
+        catalog_cache.record_not_modified()
+        response = app.response_class(status=304)
+        response.set_etag(CatalogCache.etag(version, category, available_only))
+    else:
+        etag, body = catalog_cache.get(version, category, available_only)
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
     
-    return jsonify([{
-        'id': p.id,
-        'name': p.name,
-        'price': p.price,
-        'category': p.category,
-        'sku': p.sku,
-        'inventory_count': p.inventory_count,
-        'is_available': p.is_available,
-        'image_url': p.image_url
-    } for p in products])
+    # Clients may keep the list but must revalidate it with the ETag
+    response.cache_control.no_cache = True
+    return response
 
-@app.route('/api/products/<product_id>/inventory', methods=['PUT'])
+@app.route('/api/products/cache', methods=['GET'])
+def product_cache_stats():
+    """Report catalog cache metrics"""
+    return jsonify({'version': current_catalog_version(), **catalog_cache.stats()})
+
+@app.route('/api/products/<uuid:product_id>/inventory', methods=['PUT'])
 def update_inventory(product_id):
     """Update product inventory"""
     data = request.get_json()
@@ -441,6 +2648,7 @@ def update_inventory(product_id):
     product = Product.query.get_or_404(product_id)
     old_count = product.inventory_count
     product.inventory_count = new_count
+    mark_catalog_changed(product.id)
     
     # Queue for sync if changed
     if old_count != new_count:
@@ -463,7 +2671,7 @@ def update_inventory(product_id):
 def create_order():
     """Create a new order (works online or offline)"""
     data = request.get_json()
-    device_id = data.get('device_id')
+    device_id = g.device_id = data.get('device_id')
     is_offline = data.get('is_offline', False)
     
     # Generate order number
@@ -471,6 +2679,8 @@ def create_order():
     
     # Calculate totals
     items = data.get('items', [])
+    if any(canonical_uuid(item.get('product_id')) is None for item in items):
+        return jsonify({'success': False, 'error': 'Every item needs a UUID product_id'}), 400
     subtotal = sum(item['quantity'] * item['unit_price'] for item in items)
     tax = subtotal * 0.1  # 10% tax for example
     total = subtotal + tax - data.get('discount_amount', 0)
@@ -514,24 +2724,18 @@ def create_order():
         order_items.append(order_item)
         db.session.add(order_item)
     
-    db.session.commit()
-    
-    # Generate barcode
+    # Sign the barcode payload now, the image is rendered off the request thread
     order_data = {
         'id': order.id,
         'order_number': order.order_number,
         'total_amount': total,
         'created_at': order.created_at.isoformat(),
-        'items': items,
         'customer_id': data.get('customer_id')
     }
+    order.barcode_data = BarcodeGenerator.build_qr_payload(order_data)
+    db.session.commit()
     
-    barcode_result = BarcodeGenerator.generate_qr_code(order_data)
-    
-    if barcode_result:
-        order.barcode_data = barcode_result['qr_data']
-        order.barcode_image = barcode_result['qr_image']
-        db.session.commit()
+    _queue_barcode_render(order.id, order.barcode_data, device_id)
     
     # If offline, queue for sync
     if is_offline:
@@ -552,18 +2756,18 @@ def create_order():
                 'customer_email': data.get('customer_email'),
                 'customer_phone': data.get('customer_phone'),
                 'items': items,
-                'barcode_data': barcode_result['qr_data'] if barcode_result else None,
-                'barcode_image': barcode_result['qr_image'] if barcode_result else None,
+                'barcode_data': order.barcode_data,
                 'metadata': order.metadata_json,
                 'created_at': order.created_at.isoformat()
             },
             device_id=device_id
         )
     
-    # Emit real-time update
-    socketio.emit('order_created', {
+    # Emit real-time update to the tills in the same store
+    realtime.emit_to_store_of(device_id, 'order_created', {
         'order_id': order.id,
         'order_number': order_number,
+        'device_id': device_id,
         'status': 'pending',
         'is_offline': is_offline
     })
@@ -573,99 +2777,152 @@ def create_order():
         'order_id': order.id,
         'order_number': order_number,
         'total_amount': total,
-        'barcode': barcode_result,
+        'barcode': _barcode_response(order),
         'sync_required': is_offline
     })
 
-@app.route('/api/orders/<order_id>/complete', methods=['POST'])
+@app.route('/api/orders/<uuid:order_id>/complete', methods=['POST'])
 def complete_order(order_id):
     """Complete an order and generate final barcode"""
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(selectinload(Order.order_items)).filter_by(id=order_id).first_or_404()
     data = request.get_json()
     
     # Update order status
+    if order.status != 'completed':
+        record_sale(order.created_at, order.device_id, order.is_online, order.total_amount)
     order.status = 'completed'
+    record_change('order', order.id, order.device_id)
     order.payment_status = data.get('payment_status', 'completed')
     order.payment_method = data.get('payment_method', order.payment_method)
     order.updated_at = datetime.utcnow()
     
+    order_items = order.order_items
+    
     # Generate final barcode if not already generated
-    if not order.barcode_data:
+    new_barcode = not order.barcode_data
+    if new_barcode:
         order_data = {
             'id': order.id,
             'order_number': order.order_number,
             'total_amount': order.total_amount,
             'created_at': order.created_at.isoformat(),
-            'items': [{
-                'product_id': item.product_id,
-                'product_name': item.product_name,
-                'quantity': item.quantity,
-                'unit_price': item.unit_price
-            } for item in order.order_items],
             'customer_id': None
         }
-        
-        barcode_result = BarcodeGenerator.generate_qr_code(order_data)
-        if barcode_result:
-            order.barcode_data = barcode_result['qr_data']
-            order.barcode_image = barcode_result['qr_image']
+        order.barcode_data = BarcodeGenerator.build_qr_payload(order_data)
+    
+    sync_items = []
+    new_counts = {}
     
     # Update inventory if needed
     if order.status == 'completed':
-        for item in order.order_items:
-            product = Product.query.get(item.product_id)
-            if product and product.inventory_count is not None:
-                product.inventory_count -= item.quantity
-                product.updated_at = datetime.utcnow()
-                
-                # Queue inventory sync
-                sync_engine.queue_for_sync(
-                    entity_type='inventory',
-                    entity_id=product.id,
-                    operation='update',
-                    data={
-                        'product_id': product.id,
-                        'new_count': product.inventory_count,
-                        'timestamp': datetime.utcnow().isoformat()
-                    },
-                    device_id=order.device_id
-                )
+        deltas = {}
+        for item in order_items:
+            deltas[item.product_id] = deltas.get(item.product_id, 0) + item.quantity
+        new_counts = sync_engine.apply_inventory_deltas(deltas)
+        
+        # Queue inventory sync
+        timestamp = datetime.utcnow().isoformat()
+        sync_items.extend({
+            'entity_type': 'inventory',
+            'entity_id': product_id,
+            'operation': 'update',
+            'data': {
+                'product_id': product_id,
+                'new_count': new_count,
+                'timestamp': timestamp
+            },
+            'device_id': order.device_id
+        } for product_id, new_count in new_counts.items())
     
     # Update sync status if this was an offline order
     if not order.is_online and order.sync_status == 'pending':
         order.sync_status = 'queued'
-        sync_engine.queue_for_sync(
-            entity_type='order',
-            entity_id=order.id,
-            operation='update',
-            data={
+        sync_items.append({
+            'entity_type': 'order',
+            'entity_id': order.id,
+            'operation': 'update',
+            'data': {
                 'id': order.id,
                 'status': 'completed',
                 'payment_status': order.payment_status,
                 'payment_method': order.payment_method,
                 'barcode_data': order.barcode_data,
-                'barcode_image': order.barcode_image,
                 'updated_at': order.updated_at.isoformat()
             },
-            device_id=order.device_id
-        )
+            'device_id': order.device_id
+        })
     
+    # Everything above lands in one transaction
+    sync_engine.queue_many(sync_items, commit=False)
     db.session.commit()
     
+    if new_barcode:
+        _queue_barcode_render(order.id, order.barcode_data, order.device_id)
+    
+    # Busy products change many times a second at peak, tills only need the latest count
+    for product_id, new_count in new_counts.items():
+        realtime.emit('inventory_updated', {
+            'product_id': product_id,
+            'inventory_count': new_count
+        }, coalesce_key=product_id)
+    
     return jsonify({
         'success': True,
         'order_id': order.id,
         'status': 'completed',
         'barcode': {
             'data': order.barcode_data,
-            'image': order.barcode_image
+            'image_url': barcode_url(order.id, order.barcode_data)
         }
     })
 
-@app.route('/api/orders/<order_id>/scan', methods=['POST'])
+@app.route('/api/orders/<uuid:order_id>/barcode.png', methods=['GET'])
+def get_order_barcode_png(order_id):
+    """Serve an order's QR code as a cacheable PNG rendered from barcode_data"""
+    barcode_data = db.session.query(Order.barcode_data).filter(Order.id == order_id).scalar()
+    if not barcode_data:
+        return jsonify({'success': False, 'error': 'Order has no barcode'}), 404
+    if not barcode_renderable(barcode_data):
+        # Retrying cannot help, the payload is larger than any QR code
+        return jsonify({'success': False, 'error': 'Barcode payload too large for a QR code'}), 422
+    
+    etag = barcode_etag(barcode_data)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        png_bytes = barcode_cache.get(etag)
+        if png_bytes is None:
+            try:
+                png_bytes = qr_pool.render(barcode_data)
+            except Exception as e:
+                logger.error(f"Error rendering QR code for order {order_id}: {str(e)}")
+                return jsonify({'success': False, 'error': 'QR rendering failed'}), 503
+            if png_bytes is None:
+                return jsonify({'success': False, 'error': 'QR renderer busy'}), 503, {'Retry-After': '1'}
+            barcode_cache.put(etag, png_bytes)
+        response = app.response_class(png_bytes, mimetype='image/png')
+    
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+@app.route('/api/qr/stats', methods=['GET'])
+def qr_stats():
+    """Report QR render pool and image cache metrics"""
+    return jsonify({'pool': qr_pool.stats(), 'cache': barcode_cache.stats()})
+
+@app.route('/api/orders/<uuid:order_id>/scan', methods=['POST'])
+@read_replica
 def scan_order_barcode(order_id):
     """Scan order barcode for verification"""
-    order = Order.query.get_or_404(order_id)
+    query = Order.query.options(selectinload(Order.order_items)).filter_by(id=order_id)
+    order = query.first()
+    # An order created moments ago may not have reached the replica yet
+    if order is None and use_primary():
+        order = query.first()
+    if order is None:
+        abort(404)
     
     # Check if barcode is valid
     scan_data = request.get_json().get('scan_data')
@@ -690,76 +2947,477 @@ def scan_order_barcode(order_id):
         }
     })
 
+# Sync wire format
+SYNC_JSON = 'application/json'
+SYNC_MSGPACK = 'application/msgpack'
+SYNC_NDJSON = 'application/x-ndjson'
+# Bodies that may hold a sequence of objects rather than one
+SYNC_STREAM_TYPES = (SYNC_MSGPACK, SYNC_NDJSON)
+
+def _optional_module(name):
+    """Import an optional wire-format dependency on first use, None if it is not installed"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+class _LimitedReader(io.RawIOBase):
+    """Raw stream that refuses to yield more than limit decompressed bytes"""
+    def __init__(self, source, limit):
+        self.source = source
+        self.limit = limit
+        self.total = 0
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        data = self.source.read(len(buffer))
+        self.total += len(data)
+        if self.total > self.limit:
+            raise RequestEntityTooLarge(f"Sync body exceeds {self.limit} bytes once decompressed")
+        buffer[:len(data)] = data
+        return len(data)
+
+def sync_content_encoding():
+    return (request.headers.get('Content-Encoding') or 'identity').strip().lower()
+
+def sync_request_stream():
+    """The request body as a buffered stream, decompressed according to Content-Encoding"""
+    encoding = sync_content_encoding()
+    source = request.stream
+    if encoding == 'gzip':
+        source = gzip.GzipFile(fileobj=source, mode='rb')
+    elif encoding == 'zstd':
+        zstandard = _optional_module('zstandard')
+        if zstandard is None:
+            raise UnsupportedMediaType('zstd bodies need the zstandard package')
+        source = zstandard.ZstdDecompressor().stream_reader(source)
+    elif encoding != 'identity':
+        raise UnsupportedMediaType(f"Unsupported Content-Encoding: {encoding}")
+    return io.BufferedReader(_LimitedReader(source, app.config['SYNC_MAX_BODY_BYTES']))
+
+def iter_sync_objects():
+    """Objects in the request body, decoded one at a time. JSON bodies hold one object,
+    MessagePack and NDJSON bodies may hold a sequence. Raises ValueError on malformed input."""
+    stream = sync_request_stream()
+    zstandard = _optional_module('zstandard') if sync_content_encoding() == 'zstd' else None
+    corrupt = (OSError, EOFError) + ((zstandard.ZstdError,) if zstandard else ())
+    try:
+        yield from _decode_sync_objects(stream)
+    except corrupt as e:
+        raise ValueError(f"corrupt compressed body: {str(e)}")
+
+def _decode_sync_objects(stream):
+    if request.mimetype == SYNC_MSGPACK:
+        msgpack = _optional_module('msgpack')
+        if msgpack is None:
+            raise UnsupportedMediaType('MessagePack bodies need the msgpack package')
+        try:
+            yield from msgpack.Unpacker(stream, raw=False, max_buffer_size=app.config['SYNC_MAX_BODY_BYTES'])
+        except msgpack.UnpackException as e:
+            raise ValueError(str(e))
+    elif request.mimetype == SYNC_NDJSON:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        body = stream.read()
+        if body.strip():
+            yield json.loads(body)
+
+def read_sync_body(objects=None):
+    """First object of the request body, {} when empty. Pass objects to keep reading the rest."""
+    data = next(objects if objects is not None else iter_sync_objects(), None)
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError('body must be an object')
+    return data
+
+def sync_response(payload, status=200):
+    """Respond in JSON or MessagePack per Accept, compressed per Accept-Encoding"""
+    msgpack = None
+    if request.accept_mimetypes.best_match([SYNC_JSON, SYNC_MSGPACK], default=SYNC_JSON) == SYNC_MSGPACK:
+        msgpack = _optional_module('msgpack')
+    if msgpack is not None:
+        body = msgpack.packb(payload, use_bin_type=True, default=app.json.default)
+        mimetype = SYNC_MSGPACK
+    else:
+        body = app.json.dumps(payload, separators=(',', ':')).encode()
+        mimetype = SYNC_JSON
+
+    response = app.response_class(body, status=status, mimetype=mimetype)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    if len(body) >= app.config['SYNC_COMPRESS_MIN_BYTES']:
+        encodings = request.accept_encodings
+        zstandard = _optional_module('zstandard') if encodings['zstd'] else None
+        if zstandard is not None:
+            response.set_data(zstandard.ZstdCompressor(level=3).compress(body))
+            response.headers['Content-Encoding'] = 'zstd'
+        elif encodings['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route('/api/sync/pull', methods=['POST'])
+@read_replica
 def pull_updates():
-    """Pull updates from cloud for offline devices"""
-    data = request.get_json()
-    device_id = data.get('device_id')
-    last_sync_str = data.get('last_sync')
+    """Pull one page of updates for offline devices, resume with the returned cursor"""
+    try:
+        data = read_sync_body()
+    except ValueError as e:
+        return sync_response({'success': False, 'error': f"Invalid body: {str(e)}"}, 400)
+    device_id = g.device_id = data.get('device_id')
+    try:
+        after_seq, max_rows, max_bytes = _pull_position(data)
+    except ValueError as e:
+        return sync_response({'success': False, 'error': str(e)}, 400)
+    
+    updates, next_seq, has_more = sync_engine.pull_updates(device_id, after_seq, max_rows, max_bytes)
     
+    return sync_response({
+        'success': True,
+        'updates': updates,
+        'cursor': encode_sync_cursor(next_seq),
+        'has_more': has_more,
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+def _pull_position(data):
+    """Starting seq and page bounds for a pull, raises ValueError for a bad cursor or bound"""
+    cursor = data.get('cursor')
+    if cursor:
+        after_seq = decode_sync_cursor(cursor)
+    else:
+        # First pull, or a device still sending the old timestamp
+        try:
+            last_sync = datetime.fromisoformat(data.get('last_sync'))
+        except:
+            last_sync = datetime.utcnow() - timedelta(hours=24)
+        after_seq = sync_engine.start_seq_for(last_sync)
+    
+    # Devices may ask for smaller pages than the server maximum
+    max_rows = _page_bound(data, 'limit', app.config['SYNC_PULL_PAGE_ROWS'])
+    max_bytes = _page_bound(data, 'max_bytes', app.config['SYNC_PULL_PAGE_BYTES'])
+    return after_seq, max_rows, max_bytes
+
+def _page_bound(data, field, maximum):
+    """data[field] clamped to 1..maximum, maximum when absent, ValueError if not an integer"""
+    value = data.get(field)
+    if not value:
+        return maximum
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+    return max(1, min(value, maximum))
+
+def _watch_timeout(value):
+    limit = app.config['SYNC_WATCH_TIMEOUT_SECONDS']
+    try:
+        return max(0.0, min(float(value), limit)) if value is not None else limit
+    except (TypeError, ValueError):
+        return limit
+
+@app.route('/api/sync/watch', methods=['POST'])
+def watch_updates():
+    """Long-poll: like pull, but waits up to timeout seconds for changes before answering.
+    Also reports the device's pending push items, so tills need not poll /api/sync/status."""
+    try:
+        data = read_sync_body()
+    except ValueError as e:
+        return sync_response({'success': False, 'error': f"Invalid body: {str(e)}"}, 400)
+    device_id = g.device_id = data.get('device_id')
     try:
-        last_sync = datetime.fromisoformat(last_sync_str)
-    except:
-        last_sync = datetime.utcnow() - timedelta(hours=24)
+        after_seq, max_rows, max_bytes = _pull_position(data)
+    except ValueError as e:
+        return sync_response({'success': False, 'error': str(e)}, 400)
     
-    updates = sync_engine.pull_updates(device_id, last_sync)
+    updates, next_seq, has_more = change_feed.wait_for_updates(
+        device_id, after_seq, _watch_timeout(data.get('timeout')), max_rows, max_bytes
+    )
     
-    return jsonify({
+    return sync_response({
         'success': True,
         'updates': updates,
+        'cursor': encode_sync_cursor(next_seq),
+        'has_more': has_more,
+        'changed': bool(has_more or any(updates.values())),
+        'pending_items': sync_counters.get(device_id),
         'timestamp': datetime.utcnow().isoformat()
     })
 
+def _sse_event(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, separators=(',', ':'), default=app.json.default)}"]
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/sync/events', methods=['GET'])
+def sync_events():
+    """Server-Sent Events: one 'changes' event per page of updates. The event id is the
+    cursor, so a reconnecting EventSource resumes from Last-Event-ID. Where responses are
+    buffered (Vercel) the stream ends after the first event or the wait, and EventSource reconnects."""
+    device_id = request.args.get('device_id')
+    data = {
+        'cursor': request.headers.get('Last-Event-ID') or request.args.get('cursor'),
+        'last_sync': request.args.get('last_sync'),
+        'limit': request.args.get('limit'),
+        'max_bytes': request.args.get('max_bytes')
+    }
+    try:
+        after_seq, max_rows, max_bytes = _pull_position(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    streaming = app.config['SYNC_EVENTS_STREAMING']
+    
+    def generate(after_seq):
+        deadline = time.monotonic() + (app.config['SYNC_EVENTS_STREAM_SECONDS'] if streaming else 0)
+        yield f"retry: {app.config['SYNC_WATCH_POLL_MS']}\n\n"
+        while True:
+            wait = _watch_timeout(None) if streaming else _watch_timeout(request.args.get('timeout'))
+            updates, after_seq, has_more = change_feed.wait_for_updates(device_id, after_seq, wait, max_rows, max_bytes)
+            cursor = encode_sync_cursor(after_seq)
+            if has_more or any(updates.values()):
+                yield _sse_event('changes', {
+                    'updates': updates,
+                    'cursor': cursor,
+                    'has_more': has_more,
+                    'pending_items': sync_counters.get(device_id)
+                }, cursor)
+                if not streaming and not has_more:
+                    return
+            else:
+                # Keeps proxies from closing an idle stream, the bare id still moves Last-Event-ID on
+                yield f": keepalive\nid: {cursor}\n\n"
+            if time.monotonic() >= deadline and not has_more:
+                return
+    
+    response = app.response_class(stream_with_context(generate(after_seq)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _validate_push(updates):
+    """Check a push payload up front, returns a list of error strings"""
+    errors = []
+    if not isinstance(updates, dict):
+        return ['updates must be an object']
+    
+    orders = updates.get('orders', [])
+    products = updates.get('products', [])
+    if not isinstance(orders, list) or not isinstance(products, list):
+        return ['updates.orders and updates.products must be lists']
+    
+    for index, order_data in enumerate(orders):
+        if not isinstance(order_data, dict):
+            errors.append(f"orders[{index}]: must be an object")
+            continue
+        for field in ('id', 'order_number', 'total_amount'):
+            if order_data.get(field) in (None, ''):
+                errors.append(f"orders[{index}]: missing {field}")
+        if order_data.get('id') and canonical_uuid(order_data['id']) is None:
+            errors.append(f"orders[{index}]: id must be a UUID")
+        items = order_data.get('items', [])
+        if not isinstance(items, list):
+            errors.append(f"orders[{index}]: items must be a list")
+        elif any(not isinstance(item, dict) or canonical_uuid(item.get('product_id')) is None for item in items):
+            errors.append(f"orders[{index}]: every item needs a UUID product_id")
+    
+    for index, product_data in enumerate(products):
+        if not isinstance(product_data, dict):
+            errors.append(f"products[{index}]: must be an object")
+        elif not product_data.get('id'):
+            errors.append(f"products[{index}]: missing id")
+        elif canonical_uuid(product_data['id']) is None:
+            errors.append(f"products[{index}]: id must be a UUID")
+    
+    return errors
+
+def _push_item(entity_type, record, device_id):
+    """Queue row for one pushed order or product"""
+    if entity_type == 'order':
+        # Images are rendered from barcode_data on demand, never store pushed copies
+        record.pop('barcode_image', None)
+    return {
+        'entity_type': entity_type,
+        'entity_id': record.get('id'),
+        'operation': 'create' if entity_type == 'order' else record.get('operation', 'update'),
+        'data': record,
+        'device_id': device_id
+    }
+
+def _queue_streamed_push(records, device_id, job_id):
+    """Validate and queue a record stream in chunks, returns (counts, errors). Nothing is
+    committed here, so the caller can roll the whole push back if any record was bad."""
+    counts = {'order': 0, 'product': 0}
+    errors = []
+    chunk = []
+    for index, record in enumerate(records, 1):
+        entity_type = next((key for key in ('order', 'product') if isinstance(record, dict) and key in record), None)
+        if entity_type is None:
+            errors.append(f"record {index}: expected an object with an order or product")
+        else:
+            record_errors = _validate_push({f"{entity_type}s": [record[entity_type]]})
+            errors.extend(f"record {index}: {error.split(': ', 1)[-1]}" for error in record_errors)
+            if not record_errors and not errors:
+                chunk.append(_push_item(entity_type, record[entity_type], device_id))
+                counts[entity_type] += 1
+        if len(errors) >= 50:
+            break
+        if len(chunk) >= app.config['SYNC_STREAM_CHUNK']:
+            sync_engine.queue_many(chunk, job_id=job_id, commit=False)
+            chunk = []
+    if chunk and not errors:
+        sync_engine.queue_many(chunk, job_id=job_id, commit=False)
+    return counts, errors
+
 @app.route('/api/sync/push', methods=['POST'])
 def push_updates():
     """Push updates from offline device"""
-    data = request.get_json()
-    device_id = data.get('device_id')
-    updates = data.get('updates', {})
-    
+    job_id = new_id()
     try:
-        # Process each update
-        for order_data in updates.get('orders', []):
-            sync_engine.queue_for_sync(
-                entity_type='order',
-                entity_id=order_data.get('id'),
-                operation='create',
-                data=order_data,
-                device_id=device_id
-            )
-        
-        for product_data in updates.get('products', []):
-            sync_engine.queue_for_sync(
-                entity_type='product',
-                entity_id=product_data.get('id'),
-                operation=product_data.get('operation', 'update'),
-                data=product_data,
-                device_id=device_id
-            )
+        objects = iter_sync_objects()
+        data = read_sync_body(objects)
+        device_id = g.device_id = data.get('device_id')
         
-        # Process sync queue immediately
+        if request.mimetype in SYNC_STREAM_TYPES and 'updates' not in data:
+            # Header object, then one {"order": ...} or {"product": ...} record per object
+            counts, errors = _queue_streamed_push(objects, device_id, job_id)
+            if errors:
+                db.session.rollback()
+                return sync_response({'success': False, 'errors': errors}, 400)
+            db.session.commit()
+        else:
+            updates = data.get('updates', {})
+            errors = _validate_push(updates)
+            if errors:
+                return sync_response({'success': False, 'errors': errors}, 400)
+            orders = updates.get('orders', [])
+            products = updates.get('products', [])
+            counts = {'order': len(orders), 'product': len(products)}
+            items = [_push_item('order', order_data, device_id) for order_data in orders] + \
+                    [_push_item('product', product_data, device_id) for product_data in products]
+            sync_engine.queue_many(items, job_id=job_id)
+    except ValueError as e:
+        db.session.rollback()
+        return sync_response({'success': False, 'error': f"Invalid body: {str(e)}"}, 400)
+    except HTTPException:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        return sync_response({'success': False, 'error': str(e)}, 500)
+    
+    # Serverless instances freeze after responding, so drain before returning there
+    if os.environ.get('VERCEL'):
         sync_engine.process_sync_queue()
-        
-        return jsonify({
-            'success': True,
-            'message': f"Queued {len(updates.get('orders', []))} orders and {len(updates.get('products', []))} products for sync"
-        })
+    else:
+        sync_engine.schedule_drain()
+    
+    return sync_response({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f"/api/sync/jobs/{job_id}",
+        'message': f"Queued {counts['order']} orders and {counts['product']} products for sync"
+    }, 202)
+
+@app.route('/api/sync/jobs/<uuid:job_id>', methods=['GET'])
+def get_sync_job(job_id):
+    """Poll the progress of a push"""
+    status = sync_engine.job_status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify({'success': True, **status})
+
+@app.route('/api/sync/dead-letters', methods=['GET'])
+def list_dead_letters():
+    """Sync items that ran out of retries, newest first"""
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    query = SyncDeadLetter.query
+    for field in ('job_id', 'entity_type', 'device_id'):
+        if request.args.get(field):
+            query = query.filter(getattr(SyncDeadLetter, field) == request.args[field])
+    
+    items = query.order_by(SyncDeadLetter.failed_at.desc()).limit(limit).all()
+    return jsonify({
+        'success': True,
+        'total': query.count(),
+        'items': [{
+            'id': item.id,
+            'entity_type': item.entity_type,
+            'entity_id': item.entity_id,
+            'operation': item.operation,
+            'device_id': item.device_id,
+            'job_id': item.job_id,
+            'retry_count': item.retry_count,
+            'last_error': item.last_error,
+            'created_at': item.created_at.isoformat() if item.created_at else None,
+            'failed_at': item.failed_at.isoformat() if item.failed_at else None
+        } for item in items]
+    })
+
+@app.route('/api/sync/dead-letters/requeue', methods=['POST'])
+def requeue_dead_letters():
+    """Put dead-lettered (and older failed) sync items back on the queue in bulk"""
+    data = request.get_json() or {}
+    ids = data.get('ids') or []
+    if not isinstance(ids, list) or any(canonical_uuid(item_id) is None for item_id in ids):
+        return jsonify({'success': False, 'error': 'ids must be a list of UUIDs'}), 400
+    if data.get('job_id') and canonical_uuid(data['job_id']) is None:
+        return jsonify({'success': False, 'error': 'job_id must be a UUID'}), 400
+    if not (ids or data.get('job_id') or data.get('entity_type') or data.get('device_id') or data.get('all')):
+        return jsonify({'success': False, 'error': 'Give ids, job_id, entity_type, device_id or all: true'}), 400
+    
+    try:
+        requeued = sync_engine.requeue_dead_letters(
+            ids=ids,
+            job_id=data.get('job_id'),
+            entity_type=data.get('entity_type'),
+            device_id=data.get('device_id')
+        )
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
+    
+    if requeued:
+        if os.environ.get('VERCEL'):
+            sync_engine.process_sync_queue()
+        else:
+            sync_engine.schedule_drain()
+    return jsonify({'success': True, 'requeued': requeued})
 
 @app.route('/api/sync/process', methods=['POST'])
 def process_sync():
     """Manually trigger sync processing"""
-    sync_engine.process_sync_queue()
-    return jsonify({'success': True, 'message': 'Sync processing completed'})
+    run = sync_engine.process_sync_queue()
+    if run is None:
+        return jsonify({'success': True, 'message': 'Sync already in progress'})
+    return jsonify({'success': True, 'message': 'Sync processing completed', 'run': run})
+
+@app.route('/api/sync/retention', methods=['POST'])
+def run_sync_retention():
+    """Run one retention pass now (for schedulers such as cron on serverless deployments)"""
+    run = sync_retention.run()
+    if run is None:
+        return jsonify({'success': True, 'message': 'Retention already in progress'})
+    return jsonify({'success': True, 'run': run})
+
+@app.route('/api/sync/stats', methods=['GET'])
+def sync_stats():
+    """Report sync drain throughput"""
+    return jsonify({**sync_engine.stats(), 'retention': sync_retention.last_run,
+                    'pending_counters': sync_counters.last_reconcile, 'leader': background_leader.stats()})
 
 @app.route('/api/devices/register', methods=['POST'])
 def register_device():
     """Register a new device for offline operation"""
     data = request.get_json()
-    device_id = data.get('device_id')
+    device_id = g.device_id = data.get('device_id')
     name = data.get('name')
     location = data.get('location')
+    store_id = data.get('store_id')
+    now = datetime.utcnow()
     
     device = Device.query.filter_by(device_id=device_id).first()
     
@@ -768,17 +3426,22 @@ def register_device():
             device_id=device_id,
             name=name,
             location=location,
+            store_id=store_id,
             is_online=True,
-            last_seen=datetime.utcnow(),
+            last_seen=now,
             ip_address=request.remote_addr
         )
         db.session.add(device)
     else:
         device.is_online = True
-        device.last_seen = datetime.utcnow()
+        device.last_seen = now
         device.ip_address = request.remote_addr
+        if store_id:
+            device.store_id = store_id
     
     db.session.commit()
+    realtime.remember_store(device.device_id, device.store_id)
+    device_presence.remember(device_id, now)
     
     return jsonify({
         'success': True,
@@ -786,49 +3449,75 @@ def register_device():
         'registered': True
     })
 
+DASHBOARD_RANGES = {'today': 1, 'week': 7, 'month': 30}
+
 @app.route('/api/dashboard/stats', methods=['GET'])
+@read_replica
 def get_dashboard_stats():
-    """Get dashboard statistics"""
-    # Today's sales
+    """Get dashboard statistics for today, the last 7 days or the last 30 days"""
+    range_name = request.args.get('range', 'today')
+    if range_name not in DASHBOARD_RANGES:
+        return jsonify({'success': False, 'error': f"range must be one of {', '.join(DASHBOARD_RANGES)}"}), 400
+    
+    stats = dashboard_cache.get(range_name)
+    if stats is None:
+        stats = _build_dashboard_stats(range_name)
+        dashboard_cache.put(range_name, stats)
+    return jsonify(stats)
+
+def _build_dashboard_stats(range_name):
+    """Read totals from the sales rollups, cost does not grow with order volume"""
     today = datetime.utcnow().date()
-    today_start = datetime.combine(today, datetime.min.time())
+    start = today - timedelta(days=DASHBOARD_RANGES[range_name] - 1)
     
-    today_sales = db.session.query(
-        func.sum(Order.total_amount).label('total'),
-        func.count(Order.id).label('count')
+    rows = db.session.query(
+        SalesRollup.bucket_date,
+        SalesRollup.channel,
+        func.sum(SalesRollup.order_count).label('count'),
+        func.sum(SalesRollup.total_sales).label('total')
     ).filter(
-        Order.created_at >= today_start,
-        Order.status == 'completed'
-    ).first()
+        SalesRollup.bucket_date >= start,
+        SalesRollup.bucket_date <= today
+    ).group_by(SalesRollup.bucket_date, SalesRollup.channel).all()
     
-    # Offline vs Online sales
-    sales_breakdown = db.session.query(
-        Order.is_online,
-        func.count(Order.id).label('count'),
-        func.sum(Order.total_amount).label('total')
-    ).filter(
-        Order.created_at >= today_start,
-        Order.status == 'completed'
-    ).group_by(Order.is_online).all()
+    today_sales = {'total_sales': 0.0, 'order_count': 0}
+    breakdown = {}
+    by_day = {}
+    for row in rows:
+        count = int(row.count or 0)
+        total = float(row.total or 0)
+        if row.bucket_date == today:
+            today_sales['total_sales'] += total
+            today_sales['order_count'] += count
+        channel = breakdown.setdefault(row.channel, {'type': row.channel, 'count': 0, 'total': 0.0})
+        channel['count'] += count
+        channel['total'] += total
+        day = by_day.setdefault(row.bucket_date, {'date': row.bucket_date.isoformat(), 'order_count': 0, 'total_sales': 0.0})
+        day['order_count'] += count
+        day['total_sales'] += total
     
     # Recent orders
-    recent_orders = Order.query.filter(
+    recent_orders = db.session.query(
+        Order.order_number,
+        Order.total_amount,
+        Order.customer_name,
+        Order.status,
+        Order.created_at
+    ).filter(
         Order.status == 'completed'
     ).order_by(Order.created_at.desc()).limit(10).all()
     
-    return jsonify({
-        'today': {
-            'total_sales': float(today_sales.total or 0),
-            'order_count': today_sales.count or 0
+    return {
+        'today': today_sales,
+        'period': {
+            'range': range_name,
+            'from': start.isoformat(),
+            'to': today.isoformat(),
+            'total_sales': sum(day['total_sales'] for day in by_day.values()),
+            'order_count': sum(day['order_count'] for day in by_day.values()),
+            'by_day': [by_day[day] for day in sorted(by_day)]
         },
-        'breakdown': [
-            {
-                'type': 'online' if breakdown.is_online else 'offline',
-                'count': breakdown.count,
-                'total': float(breakdown.total or 0)
-            }
-            for breakdown in sales_breakdown
-        ],
+        'breakdown': list(breakdown.values()),
         'recent_orders': [
             {
                 'order_number': order.order_number,
@@ -839,7 +3528,91 @@ def get_dashboard_stats():
             }
             for order in recent_orders
         ]
-    })
+    }
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    
+    try:
+        depth = db.session.query(SyncQueue.status, func.count(SyncQueue.id)).group_by(SyncQueue.status).all()
+        dead_letters = SyncDeadLetter.query.count()
+    except Exception as e:
+        logger.error(f"Error reading sync queue depth: {str(e)}")
+        db.session.rollback()
+        depth, dead_letters = [], 0
+    lines.extend(render_gauge('pos_sync_queue_depth', 'Sync queue rows by status',
+                              [((status,), count) for status, count in depth], ('status',)))
+    lines.extend(render_gauge('pos_sync_dead_letters', 'Sync items that ran out of retries', [((), dead_letters)]))
+    
+    sync = sync_engine.stats()
+    last_run = sync['last_run'] or {}
+    lines.extend(render_gauge('pos_sync_drain_items_per_second', 'Throughput of the last sync drain',
+                              [((), last_run.get('items_per_second', 0.0))]))
+    lines.extend(render_gauge('pos_sync_in_progress', 'Whether a sync drain is running in this process',
+                              [((), int(sync['is_syncing']))]))
+    
+    presence = device_presence.stats()
+    lines.extend(render_gauge('pos_device_heartbeats_pending', 'Coalesced heartbeats waiting for the next flush',
+                              [((), presence['pending_writes'])]))
+    
+    if app.config['DATABASE_REPLICA_URL']:
+        replica = replica_router.stats()
+        lines.extend(render_gauge('pos_db_replica_healthy', 'Whether the read replica answered its last lag check',
+                                  [((), int(replica['healthy']))]))
+        lines.extend(render_gauge('pos_db_replica_lag_seconds', 'Read replica lag behind the change log head',
+                                  [((), replica['lag_seconds'] or 0.0)]))
+    
+    lines.extend(render_gauge('pos_background_leader', 'Whether this process runs the sync drain and retention',
+                              [((), int(background_leader.is_leader))]))
+    
+    lines.extend(render_gauge('pos_sync_watchers', 'Long-polls and event streams waiting for changes in this process',
+                              [((), change_feed.waiting)]))
+    
+    qr = qr_pool.stats()
+    lines.extend(render_gauge('pos_qr_render_pending', 'QR renders queued or running', [((), qr['pending'])]))
+    
+    pool = db.engine.pool
+    if isinstance(pool, QueuePool):
+        lines.extend(render_gauge('pos_db_pool_connections', 'Pooled database connections by state',
+                                  [(('checked_out',), pool.checkedout()), (('idle',), pool.checkedin()),
+                                   (('overflow',), max(pool.overflow(), 0))], ('state',)))
+        lines.extend(render_gauge('pos_db_pool_size', 'Configured pool size', [((), pool.size())]))
+    
+    now = time.time()
+    lines.extend(render_gauge('pos_background_thread_alive', 'Background thread liveness',
+                              [((name,), int(thread.is_alive())) for name, (thread, _) in sorted(background_threads.items())],
+                              ('thread',)))
+    lines.extend(render_gauge('pos_background_thread_heartbeat_age_seconds', 'Seconds since a background thread last reported in',
+                              [((name,), round(now - beat, 3)) for name, (_, beat) in sorted(background_threads.items())],
+                              ('thread',)))
+    
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# WebSocket events
+@socketio.on('join')
+def handle_join(data):
+    """Subscribe a till to its device and store rooms"""
+    data = data or {}
+    realtime.join(data.get('device_id'), data.get('store_id'))
+    emit('joined', {'device_id': data.get('device_id')})
+
+@socketio.on('device_heartbeat')
+def handle_device_heartbeat(data):
+    data = data or {}
+    # Older clients never send join, their first heartbeat subscribes them
+    realtime.join(data.get('device_id'), data.get('store_id'))
+    DEVICE_HEARTBEATS.inc('socket')
+    device_presence.beat(data.get('device_id'), request.remote_addr)
+    emit('heartbeat_ack', {'timestamp': datetime.utcnow().isoformat()})
+
+@app.route('/api/realtime/stats', methods=['GET'])
+def realtime_stats():
+    """Report realtime fan-out metrics"""
+    return jsonify(realtime.stats())
 
 # WebSocket -> HTTP fallbacks
 @app.route('/api/ws/connect', methods=['POST'])
@@ -856,41 +3629,164 @@ def ws_disconnect():
 
 @app.route('/api/device/heartbeat', methods=['POST'])
 def http_device_heartbeat():
-    data = request.get_json() or {}
-    device_id = data.get('device_id')
-    if device_id:
-        device = Device.query.filter_by(device_id=device_id).first()
-        if device:
-            device.is_online = True
-            device.last_seen = datetime.utcnow()
-            db.session.commit()
-            return jsonify({'success': True, 'timestamp': datetime.utcnow().isoformat()})
-    return jsonify({'success': False}), 400
+    data = request.get_json(silent=True) or {}
+    DEVICE_HEARTBEATS.inc('http')
+    seen_at = device_presence.beat(data.get('device_id'), request.remote_addr)
+    if seen_at is None:
+        return jsonify({'success': False}), 400
+    return jsonify({'success': True, 'timestamp': seen_at.isoformat()})
+
+@app.route('/api/devices/presence', methods=['GET'])
+def devices_presence():
+    """Which devices are online, from the in-memory presence map"""
+    devices = device_presence.snapshot(request.args.get('device_id'))
+    if request.args.get('online_only', 'false').lower() == 'true':
+        devices = [device for device in devices if device['online']]
+    return jsonify({
+        'devices': devices,
+        'online': sum(1 for device in devices if device['online']),
+        'offline_after_seconds': app.config['DEVICE_OFFLINE_AFTER_SECONDS'],
+        'timestamp': datetime.utcnow().isoformat()
+    })
 
 
 @app.route('/api/sync/status', methods=['POST'])
 def http_sync_status():
-    data = request.get_json() or {}
-    device_id = data.get('device_id')
-    pending_count = SyncQueue.query.filter_by(
-        device_id=device_id,
-        status='pending'
-    ).count()
+    data = request.get_json(silent=True) or {}
     return jsonify({
-        'pending_items': pending_count,
+        'pending_items': sync_counters.get(data.get('device_id')),
         'timestamp': datetime.utcnow().isoformat()
     })
 
 # Background sync task
 def background_sync_task():
-    """Background task to process sync queue periodically"""
+    """Drain the sync queue whenever work is committed, polling only as a safety net.
+    Only the elected leader drains, other processes just retry the election now and then."""
     with app.app_context():
+        poll = app.config['SYNC_POLL_MIN_SECONDS']
         while True:
+            background_heartbeat('sync')
+            if not background_leader.try_acquire():
+                time.sleep(app.config['BACKGROUND_LEADER_RETRY_SECONDS'])
+                continue
             try:
-                sync_engine.process_sync_queue()
+                run = sync_engine.process_sync_queue()
+                busy = bool(run and run['processed'] + run['failed'])
+                # Back off while idle, then sleep no longer than the next scheduled retry
+                poll = app.config['SYNC_POLL_MIN_SECONDS'] if busy else min(poll * 2, app.config['SYNC_POLL_MAX_SECONDS'])
+                timeout = sync_engine.seconds_until_next_retry(poll)
             except Exception as e:
                 logger.error(f"Background sync error: {str(e)}")
-            time.sleep(60)  # Run every minute
+                db.session.rollback()
+                timeout = poll
+            sync_wakeup.wait(timeout)
+
+def background_presence_task():
+    """Flush coalesced heartbeats and sweep silent devices offline"""
+    with app.app_context():
+        last_sweep = 0
+        while True:
+            background_heartbeat('presence')
+            try:
+                device_presence.flush()
+                # Sweeping a few times per offline window is enough to notice silence promptly
+                if time.monotonic() - last_sweep >= app.config['DEVICE_OFFLINE_AFTER_SECONDS'] / 3:
+                    device_presence.sweep()
+                    last_sweep = time.monotonic()
+            except Exception as e:
+                logger.error(f"Device presence error: {str(e)}")
+                db.session.rollback()
+            time.sleep(app.config['DEVICE_HEARTBEAT_FLUSH_SECONDS'])
+
+def background_counter_task():
+    """Recount the per-device pending counters every SYNC_COUNTER_RECONCILE_SECONDS"""
+    with app.app_context():
+        while True:
+            background_heartbeat('counters')
+            try:
+                sync_counters.reconcile()
+            except Exception as e:
+                logger.error(f"Pending counter reconciliation error: {str(e)}")
+                db.session.rollback()
+            time.sleep(app.config['SYNC_COUNTER_RECONCILE_SECONDS'])
+
+def background_retention_task():
+    """Run sync_queue retention every SYNC_RETENTION_INTERVAL seconds"""
+    with app.app_context():
+        while True:
+            background_heartbeat('retention')
+            # The sync thread holds the election, retention follows it
+            if not background_leader.is_leader:
+                time.sleep(app.config['BACKGROUND_LEADER_RETRY_SECONDS'])
+                continue
+            sync_retention.run()
+            time.sleep(app.config['SYNC_RETENTION_INTERVAL'])
+
+
+def init_database():
+    """Create tables and seed the single-row counters."""
+    with app.app_context():
+        db.create_all()
+        logger.info("Database tables created")
+        
+        # Seed the single-row counters so concurrent first writers only ever UPDATE
+        for model in (CatalogState, ChangeLogState):
+            if db.session.get(model, 1) is None:
+                db.session.add(model(id=1))
+        db.session.commit()
+
+
+def migrate_uuid_keys():
+    """Convert key columns that older db.create_all runs made VARCHAR(36) to UUIDType.
+    Returns the number of columns converted."""
+    inspector = db.inspect(db.engine)
+    targets = {}
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col['name']: col['type'] for col in inspector.get_columns(table.name)}
+        for col in table.columns:
+            current = existing.get(col.name)
+            if isinstance(col.type, db.Uuid) and isinstance(current, db.String) and current.length == 36:
+                targets.setdefault(table.name, []).append(col.name)
+    if not targets:
+        return 0
+    
+    with db.engine.begin() as conn:
+        if db.engine.dialect.name == 'postgresql':
+            # Foreign keys must be dropped while both sides change type, then restored as-is
+            foreign_keys = [(table_name, fk) for table_name in targets for fk in inspector.get_foreign_keys(table_name)
+                            if set(fk['constrained_columns']) & set(targets[table_name])]
+            for table_name, fk in foreign_keys:
+                conn.exec_driver_sql(f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{fk["name"]}"')
+            for table_name, columns in targets.items():
+                alters = ', '.join(f'ALTER COLUMN "{name}" TYPE uuid USING "{name}"::uuid' for name in columns)
+                conn.exec_driver_sql(f'ALTER TABLE "{table_name}" {alters}')
+            for table_name, fk in foreign_keys:
+                ondelete = fk.get('options', {}).get('ondelete')
+                conn.exec_driver_sql(
+                    f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{fk["name"]}" '
+                    f'FOREIGN KEY ({", ".join(fk["constrained_columns"])}) '
+                    f'REFERENCES "{fk["referred_table"]}" ({", ".join(fk["referred_columns"])})'
+                    + (f' ON DELETE {ondelete}' if ondelete else '')
+                )
+        else:
+            # Without a native type UUIDType stores 32 hex digits, so only the dashes go;
+            # the declared type stays VARCHAR(36), and a rerun finds no rows to rewrite
+            for table_name, columns in targets.items():
+                targets[table_name] = [name for name in columns if conn.exec_driver_sql(
+                    f'UPDATE "{table_name}" SET "{name}" = replace("{name}", \'-\', \'\') WHERE "{name}" LIKE \'%-%\''
+                ).rowcount]
+            targets = {table_name: columns for table_name, columns in targets.items() if columns}
+    
+    converted = sum(len(columns) for columns in targets.values())
+    logger.info(f"Converted {converted} key columns to UUID: {targets}")
+    return converted
+
+@app.cli.command('migrate-uuid-keys')
+def migrate_uuid_keys_command():
+    """Convert VARCHAR(36) key columns from older create_all schemas to native UUID."""
+    migrate_uuid_keys()
 
 
 def initialize_runtime():
@@ -899,12 +3795,26 @@ def initialize_runtime():
         logger.info("Serverless mode detected; skipping local runtime initialization")
         return
 
-    with app.app_context():
-        db.create_all()
-        logger.info("Database tables created")
+    init_database()
 
+    background_leader.active = True
     sync_thread = threading.Thread(target=background_sync_task, daemon=True)
+    register_background_thread('sync', sync_thread)
     sync_thread.start()
+    
+    retention_thread = threading.Thread(target=background_retention_task, daemon=True)
+    register_background_thread('retention', retention_thread)
+    retention_thread.start()
+    
+    sync_counters.background = True
+    counter_thread = threading.Thread(target=background_counter_task, daemon=True)
+    register_background_thread('counters', counter_thread)
+    counter_thread.start()
+    
+    device_presence.background = True
+    presence_thread = threading.Thread(target=background_presence_task, daemon=True)
+    register_background_thread('presence', presence_thread)
+    presence_thread.start()
 
 
 if __name__ == '__main__':
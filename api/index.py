@@ -1,4 +1,5 @@
 """Vercel entrypoint for the Flask API."""
+import sys
 from importlib.util import module_from_spec, spec_from_file_location
 from pathlib import Path
 
@@ -7,6 +8,8 @@ _spec = spec_from_file_location("pos_system", _MODULE_PATH)
 if _spec is None or _spec.loader is None:
     raise RuntimeError(f"Unable to load app module from {_MODULE_PATH}")
 _module = module_from_spec(_spec)
+# Register before executing so worker processes can pickle module-level functions
+sys.modules[_spec.name] = _module
 _spec.loader.exec_module(_module)
 
 app = _module.app
@@ -0,0 +1,493 @@
+"""Load and latency benchmark for the POS API.
+
+Seeds a database with synthetic products, devices and order history, then
+drives concurrent clients through checkout (create + complete), catalog
+loads, offline pushes and delta pulls. Reports throughput, p50/p95/p99
+latency and SQL queries per request, and saves the results as JSON so runs
+can be compared between commits.
+
+    python bench/pos_load.py --products 5000 --orders 20000 --clients 8 --duration 30
+    python bench/pos_load.py --compare bench/results/<previous>.json
+    python bench/pos_load.py --url http://localhost:5000   # drive a running server
+    python bench/pos_load.py --wire msgpack --compression zstd   # sync wire format
+
+Without --url the app is loaded in-process and exercised through Flask test
+clients. DATABASE_URL selects the database (a throwaway SQLite file by default).
+Sync push/pull bodies are sent in the format chosen by --wire/--compression and
+the report shows their bytes on the wire against the same bodies as plain JSON.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "bench" / "results"
+CATEGORIES = ['drinks', 'snacks', 'bakery', 'dairy', 'produce', 'household', 'frozen', 'stationery']
+
+# Operation mix, relative weights per client iteration
+DEFAULT_MIX = {'checkout': 6, 'products': 3, 'sync_push': 1, 'sync_pull': 2}
+
+
+def load_app(database_url):
+    """Import POS sytem.py the same way api/index.py does, with query counting on"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['QUERY_COUNT_HEADER'] = 'true'
+    spec = spec_from_file_location("pos_system", ROOT / "POS sytem.py")
+    module = module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# Synthetic data
+def generate_data(pos, products, devices, orders, seed):
+    """Bulk-insert synthetic products, devices and completed order history"""
+    rng = random.Random(seed)
+    db = pos.db
+    now = datetime.utcnow()
+
+    product_rows = [{
+        'id': str(uuid.uuid4()),
+        'name': f"Product {i:06d}",
+        'price': round(rng.uniform(0.5, 80), 2),
+        'category': rng.choice(CATEGORIES),
+        'sku': f"SKU-{i:06d}",
+        'inventory_count': rng.randint(50, 5000),
+        'is_available': rng.random() > 0.05,
+        'online_sync': True,
+        'created_at': now,
+        'updated_at': now
+    } for i in range(products)]
+
+    device_rows = [{
+        'id': str(uuid.uuid4()),
+        'device_id': f"POS-{i:03d}",
+        'name': f"Till {i}",
+        'location': 'Front Counter',
+        'store_id': f"STORE-{i % max(1, devices // 4 or 1):02d}",
+        'is_online': True,
+        'last_seen': now,
+        'created_at': now
+    } for i in range(devices)]
+
+    order_rows = []
+    item_rows = []
+    for i in range(orders):
+        order_id = str(uuid.uuid4())
+        created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        basket = rng.sample(product_rows, k=min(len(product_rows), rng.randint(1, 8)))
+        subtotal = 0.0
+        for product in basket:
+            quantity = rng.randint(1, 3)
+            subtotal += quantity * product['price']
+            item_rows.append({
+                'id': str(uuid.uuid4()),
+                'order_id': order_id,
+                'product_id': product['id'],
+                'quantity': quantity,
+                'unit_price': product['price'],
+                'total_price': quantity * product['price'],
+                'product_name': product['name'],
+                'created_at': created_at
+            })
+        order_rows.append({
+            'id': order_id,
+            'order_number': f"HIST-{i:08d}",
+            'total_amount': round(subtotal * 1.1, 2),
+            'tax_amount': round(subtotal * 0.1, 2),
+            'discount_amount': 0.0,
+            'status': 'completed',
+            'payment_method': rng.choice(['cash', 'card', 'e-wallet']),
+            'payment_status': 'completed',
+            'is_online': rng.random() > 0.3,
+            'device_id': rng.choice(device_rows)['device_id'] if device_rows else None,
+            'sync_status': 'synced',
+            'created_at': created_at,
+            'updated_at': created_at
+        })
+
+    with pos.app.app_context():
+        for model, rows in ((pos.Product, product_rows), (pos.Device, device_rows),
+                            (pos.Order, order_rows), (pos.OrderItem, item_rows)):
+            for start in range(0, len(rows), 5000):
+                db.session.execute(model.__table__.insert(), rows[start:start + 5000])
+        db.session.commit()
+        pos.rebuild_sales_rollups()
+
+    return [p['id'] for p in product_rows if p['is_available']], [d['device_id'] for d in device_rows]
+
+
+# Sync wire format
+class WireFormat:
+    """Encodes sync request bodies and decodes responses in the chosen format"""
+    def __init__(self, wire='json', compression='none'):
+        self.wire = wire
+        self.compression = compression
+        # Optional packages, only needed for the formats that use them
+        self.msgpack = __import__('msgpack') if wire == 'msgpack' else None
+        self.zstd = __import__('zstandard') if compression == 'zstd' else None
+
+    def headers(self):
+        content_type = 'application/msgpack' if self.wire == 'msgpack' else 'application/json'
+        headers = {'Content-Type': content_type, 'Accept': content_type}
+        if self.compression != 'none':
+            headers['Content-Encoding'] = self.compression
+            headers['Accept-Encoding'] = self.compression
+        return headers
+
+    def encode(self, body):
+        data = self.msgpack.packb(body) if self.msgpack else json.dumps(body, separators=(',', ':')).encode()
+        if self.compression == 'gzip':
+            data = gzip.compress(data)
+        elif self.compression == 'zstd':
+            data = self.zstd.ZstdCompressor().compress(data)
+        return data
+
+    def decode(self, data, headers):
+        encoding = headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            data = gzip.decompress(data)
+        elif encoding == 'zstd':
+            data = (self.zstd or __import__('zstandard')).ZstdDecompressor().decompressobj().decompress(data)
+        if not data:
+            return None
+        if (headers.get('Content-Type') or '').startswith('application/msgpack'):
+            return (self.msgpack or __import__('msgpack')).unpackb(data)
+        return json.loads(data)
+
+
+def json_size(payload):
+    """Bytes the payload takes as compact uncompressed JSON, the baseline for savings"""
+    return len(json.dumps(payload, separators=(',', ':')).encode()) if payload is not None else 0
+
+
+# Clients
+class InProcessClient:
+    """Drives the app through a Flask test client"""
+    def __init__(self, pos):
+        self.client = pos.app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, response.headers, response.get_json(silent=True)
+
+    def send(self, method, path, data, headers):
+        """Raw bytes in and out, for bodies that are already encoded"""
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        return response.status_code, response.headers, response.data
+
+
+class HTTPClient:
+    """Drives a running server over HTTP"""
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else None
+        headers = dict(headers or {})
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+        status, response_headers, payload = self.send(method, path, data, headers)
+        try:
+            parsed = json.loads(payload) if payload else None
+        except ValueError:
+            parsed = None
+        return status, response_headers, parsed
+
+    def send(self, method, path, data, headers):
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+
+class Recorder:
+    """Collects latency and query-count samples per operation"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, name, seconds, status, headers, basket=None, wire_bytes=None, json_bytes=None):
+        queries = headers.get('X-Query-Count') if headers is not None else None
+        with self._lock:
+            entry = self.samples.setdefault(name, {'latency': [], 'queries': [], 'errors': 0, 'by_basket': {},
+                                                   'wire_bytes': 0, 'json_bytes': 0})
+            entry['latency'].append(seconds)
+            if wire_bytes is not None:
+                entry['wire_bytes'] += wire_bytes
+                entry['json_bytes'] += json_bytes
+            if status >= 400:
+                entry['errors'] += 1
+            if queries is not None:
+                entry['queries'].append(int(queries))
+                if basket is not None:
+                    entry['by_basket'].setdefault(basket, set()).add(int(queries))
+
+
+def timed(recorder, client, name, method, path, body=None, headers=None, basket=None):
+    started = time.perf_counter()
+    status, response_headers, payload = client.request(method, path, body, headers)
+    recorder.record(name, time.perf_counter() - started, status, response_headers, basket)
+    return status, response_headers, payload
+
+
+def timed_sync(recorder, client, wire, name, path, body):
+    """Like timed, but sends the body in the sync wire format and counts its bytes"""
+    data = wire.encode(body)
+    started = time.perf_counter()
+    status, response_headers, raw = client.send('POST', path, data, wire.headers())
+    try:
+        payload = wire.decode(raw, response_headers)
+    except ValueError:
+        payload = None
+    recorder.record(name, time.perf_counter() - started, status, response_headers,
+                    wire_bytes=len(data) + len(raw), json_bytes=json_size(body) + (json_size(payload) or len(raw)))
+    return status, response_headers, payload
+
+
+def run_client(client, recorder, product_ids, device_id, mix, deadline, seed, wire):
+    rng = random.Random(seed)
+    ops = list(mix)
+    weights = [mix[op] for op in ops]
+    catalog_etag = None
+    cursor = None
+
+    while time.monotonic() < deadline:
+        op = rng.choices(ops, weights)[0]
+        if op == 'checkout':
+            basket = rng.sample(product_ids, k=min(len(product_ids), rng.choice([1, 3, 10, 40])))
+            items = [{'product_id': pid, 'quantity': rng.randint(1, 3), 'unit_price': 1.0} for pid in basket]
+            is_offline = rng.random() < 0.2
+            # Offline orders also enqueue a sync row, so they are compared separately
+            variant = f"{'offline' if is_offline else 'online'}:{len(items)}"
+            status, _, payload = timed(recorder, client, 'create_order', 'POST', '/api/orders', {
+                'device_id': device_id,
+                'items': items,
+                'payment_method': 'card',
+                'is_offline': is_offline
+            }, basket=variant)
+            if status == 200 and payload:
+                timed(recorder, client, 'complete_order', 'POST', f"/api/orders/{payload['order_id']}/complete",
+                      {'payment_status': 'completed'}, basket=variant)
+        elif op == 'products':
+            headers = {'If-None-Match': catalog_etag} if catalog_etag and rng.random() < 0.7 else None
+            status, response_headers, _ = timed(recorder, client, 'get_products', 'GET',
+                                                '/api/products?available_only=true', headers=headers)
+            if status in (200, 304):
+                catalog_etag = response_headers.get('ETag')
+        elif op == 'sync_push':
+            orders = []
+            for _ in range(rng.randint(5, 50)):
+                pid = rng.choice(product_ids)
+                orders.append({
+                    'id': str(uuid.uuid4()),
+                    'order_number': f"OFF-{uuid.uuid4().hex[:12].upper()}",
+                    'total_amount': 1.1,
+                    'status': 'completed',
+                    'created_at': datetime.utcnow().isoformat(),
+                    'items': [{'product_id': pid, 'quantity': 1, 'unit_price': 1.0, 'total_price': 1.0}]
+                })
+            timed_sync(recorder, client, wire, 'sync_push', '/api/sync/push',
+                       {'device_id': device_id, 'updates': {'orders': orders}})
+        elif op == 'sync_pull':
+            body = {'device_id': device_id}
+            if cursor:
+                body['cursor'] = cursor
+            status, _, payload = timed_sync(recorder, client, wire, 'sync_pull', '/api/sync/pull', body)
+            if status == 200 and payload:
+                cursor = payload.get('cursor')
+
+
+# Reporting
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    report = {}
+    for name, entry in sorted(recorder.samples.items()):
+        latency = sorted(entry['latency'])
+        queries = entry['queries']
+        report[name] = {
+            'requests': len(latency),
+            'errors': entry['errors'],
+            'throughput_rps': round(len(latency) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latency, 50) * 1000, 2),
+            'p95_ms': round(percentile(latency, 95) * 1000, 2),
+            'p99_ms': round(percentile(latency, 99) * 1000, 2),
+            'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'queries_min': min(queries) if queries else None,
+            'queries_max': max(queries) if queries else None,
+            'queries_by_basket': {variant: sorted(counts) for variant, counts in sorted(entry['by_basket'].items())}
+        }
+        if entry['json_bytes']:
+            report[name].update({
+                'wire_bytes': entry['wire_bytes'],
+                'json_bytes': entry['json_bytes'],
+                'byte_savings': round(1 - entry['wire_bytes'] / entry['json_bytes'], 4)
+            })
+    return report
+
+
+def check_constant_queries(report, endpoints=('create_order', 'complete_order')):
+    """Per-request query counts must not depend on basket size"""
+    failures = []
+    for name in endpoints:
+        by_channel = {}
+        for variant, counts in report.get(name, {}).get('queries_by_basket', {}).items():
+            channel, size = variant.split(':')
+            # The lowest count is the steady state, first requests may seed counters
+            by_channel.setdefault(channel, {})[int(size)] = min(counts)
+        for channel, by_size in by_channel.items():
+            if len(set(by_size.values())) > 1:
+                failures.append(f"{name} ({channel}): queries vary with basket size {dict(sorted(by_size.items()))}")
+    return failures
+
+
+def print_report(report):
+    header = f"{'operation':<16}{'reqs':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, row in report.items():
+        queries = '-' if row['queries_mean'] is None else f"{row['queries_mean']:.1f}"
+        print(f"{name:<16}{row['requests']:>8}{row['errors']:>6}{row['throughput_rps']:>9.1f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{queries:>10}")
+    for name, row in report.items():
+        if 'wire_bytes' in row:
+            print(f"{name:<16}{row['wire_bytes'] / 1024:>10.1f} KiB on the wire, {row['json_bytes'] / 1024:.1f} KiB "
+                  f"as JSON ({row['byte_savings']:.1%} saved)")
+
+
+def compare(report, baseline_path, threshold):
+    """Print p95/throughput deltas against a saved run, returns the regressions"""
+    baseline = json.loads(Path(baseline_path).read_text())['operations']
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for name, row in report.items():
+        base = baseline.get(name)
+        if not base or not base['p95_ms']:
+            continue
+        p95_delta = (row['p95_ms'] - base['p95_ms']) / base['p95_ms']
+        rps_delta = (row['throughput_rps'] - base['throughput_rps']) / base['throughput_rps'] if base['throughput_rps'] else 0.0
+        flag = ''
+        if p95_delta > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"  {name:<16} p95 {base['p95_ms']:.1f} -> {row['p95_ms']:.1f} ms ({p95_delta:+.0%}), "
+              f"rps {base['throughput_rps']:.1f} -> {row['throughput_rps']:.1f} ({rps_delta:+.0%}){flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'),
+                        help='database to seed and (in-process) serve; defaults to a temporary SQLite file')
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process app')
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--devices', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=5000, help='historical orders to seed')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load')
+    parser.add_argument('--mix', default=','.join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help='operation weights, e.g. checkout=6,products=3,sync_push=1,sync_pull=2')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse data already in the database')
+    parser.add_argument('--output', help='where to save results (default bench/results/<time>-<rev>.json)')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    parser.add_argument('--regression-threshold', type=float, default=0.10, help='allowed p95 increase')
+    parser.add_argument('--check-queries', action='store_true',
+                        help='fail if checkout query counts depend on basket size')
+    parser.add_argument('--wire', choices=['json', 'msgpack'], default='json', help='sync push/pull body format')
+    parser.add_argument('--compression', choices=['none', 'gzip', 'zstd'], default='none',
+                        help='sync push/pull body compression')
+    args = parser.parse_args(argv)
+
+    database_url = args.database_url or f"sqlite:///{Path(tempfile.mkdtemp()) / 'pos_bench.db'}"
+    mix = {k: float(v) for k, v in (part.split('=') for part in args.mix.split(','))}
+    wire = WireFormat(args.wire, args.compression)
+
+    pos = load_app(database_url)
+    pos.init_database()
+    if args.skip_seed:
+        with pos.app.app_context():
+            product_ids = [row.id for row in pos.db.session.query(pos.Product.id).filter(pos.Product.is_available == True)]
+            device_ids = [row.device_id for row in pos.db.session.query(pos.Device.device_id)]
+    else:
+        started = time.perf_counter()
+        product_ids, device_ids = generate_data(pos, args.products, args.devices, args.orders, args.seed)
+        print(f"Seeded {args.products} products, {args.devices} devices, {args.orders} orders "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    threads = []
+    for i in range(args.clients):
+        client = HTTPClient(args.url) if args.url else InProcessClient(pos)
+        device_id = device_ids[i % len(device_ids)] if device_ids else f"POS-BENCH-{i}"
+        threads.append(threading.Thread(
+            target=run_client,
+            args=(client, recorder, product_ids, device_id, mix, deadline, args.seed + i, wire),
+            daemon=True
+        ))
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    report = summarize(recorder, elapsed)
+    print_report(report)
+
+    result = {
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'target': args.url or 'in-process',
+        'database': database_url.split(':', 1)[0],
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'database_url')},
+        'elapsed_seconds': round(elapsed, 2),
+        'operations': report
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.utcnow():%Y%m%dT%H%M%S}-{result['revision']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nSaved {output}")
+
+    failed = False
+    if args.compare:
+        failed |= bool(compare(report, args.compare, args.regression_threshold))
+    if args.check_queries:
+        failures = check_constant_queries(report)
+        for failure in failures:
+            print(f"Query check failed: {failure}")
+        failed |= bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
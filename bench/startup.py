@@ -0,0 +1,171 @@
+"""Cold start benchmark for the Vercel entrypoint.
+
+Starts fresh interpreters that import api/index.py and serve their first
+requests, the way a new serverless instance does. Reports process start,
+import time and first-request latency, lists which heavy dependencies were
+loaded, and saves the results as JSON so runs can be compared between commits.
+
+    python bench/startup.py --runs 20
+    python bench/startup.py --importtime 15          # slowest imports of one run
+    python bench/startup.py --compare bench/results/<previous>.json
+    python bench/startup.py --server                 # without VERCEL (threaded server mode)
+
+DATABASE_URL selects the database (a throwaway SQLite file by default).
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from pos_load import RESULTS_DIR, ROOT, git_revision, percentile  # noqa: E402
+
+# Modules whose presence after startup shows a dependency was loaded eagerly
+HEAVY_MODULES = ['qrcode', 'PIL.Image', 'flask_socketio', 'engineio', 'sqlalchemy.dialects.postgresql', 'psycopg2']
+
+# Runs inside each fresh interpreter
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+imported = time.perf_counter()
+if sys.argv[2] == 'init':
+    index._module.init_database()
+client = index.app.test_client()
+timings = {'import': imported - started}
+for name, path in (('first_health', '/api/health'), ('first_products', '/api/products'), ('second_products', '/api/products')):
+    t = time.perf_counter()
+    response = client.get(path)
+    assert response.status_code == 200, (path, response.status_code)
+    timings[name] = time.perf_counter() - t
+print(json.dumps({'timings': timings, 'modules': len(sys.modules),
+                  'heavy': [m for m in json.loads(sys.argv[3]) if m in sys.modules]}))
+'''
+
+
+def child_env(database_url, server):
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('VERCEL', None)
+    if not server:
+        env['VERCEL'] = '1'
+    return env
+
+
+def run_child(env, mode='run', importtime=False):
+    """Start one interpreter, returns (result dict, wall seconds, stderr)"""
+    args = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [
+        '-c', CHILD, str(ROOT / 'api'), mode, json.dumps(HEAVY_MODULES)]
+    started = time.perf_counter()
+    proc = subprocess.run(args, env=env, cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(f"startup child failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), wall, proc.stderr
+
+
+def slowest_imports(stderr, limit):
+    """Top-level imports by cumulative microseconds from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if match and len(match.group(3)) <= 3:
+            rows.append((int(match.group(2)), match.group(4)))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def summarize(samples):
+    report = {}
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        report[key] = {
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2)
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{'phase':<18}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for phase, stats in report['phases'].items():
+        print(f"{phase:<18}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['max_ms']:>10}")
+    print(f"modules loaded: {report['modules']}, heavy: {', '.join(report['heavy']) or 'none'}")
+
+
+def compare(report, baseline_path, threshold):
+    """Returns phases whose p50 grew by more than threshold (a fraction)"""
+    baseline = json.loads(Path(baseline_path).read_text())
+    regressions = []
+    for phase, stats in report['phases'].items():
+        before = baseline['phases'].get(phase)
+        if not before or not before['p50_ms']:
+            continue
+        change = (stats['p50_ms'] - before['p50_ms']) / before['p50_ms']
+        print(f"{phase:<18}{before['p50_ms']:>10} -> {stats['p50_ms']:<10}{change:+.1%}")
+        if change > threshold:
+            regressions.append(phase)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('--server', action='store_true', help='profile without VERCEL set')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='print the N slowest top-level imports of one extra run')
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('--regression-threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = f"sqlite:///{Path(tempfile.mkdtemp(prefix='pos-startup-')) / 'pos.db'}"
+    env = child_env(database_url, args.server)
+
+    # Create the schema first; serverless instances never run create_all themselves
+    run_child(child_env(database_url, True), mode='init')
+
+    samples, last = [], None
+    for _ in range(args.runs):
+        last, wall, _ = run_child(env)
+        samples.append({'process': wall, **last['timings']})
+
+    report = {
+        'revision': git_revision(),
+        'mode': 'server' if args.server else 'serverless',
+        'runs': args.runs,
+        'phases': summarize(samples),
+        'modules': last['modules'],
+        'heavy': last['heavy']
+    }
+    print_report(report)
+
+    if args.importtime:
+        _, _, stderr = run_child(env, importtime=True)
+        print(f"\nslowest imports (cumulative ms):")
+        for micros, module in slowest_imports(stderr, args.importtime):
+            print(f"{micros / 1000:>10.1f}  {module}")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"startup-{time.strftime('%Y%m%d-%H%M%S')}-{report['revision']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.regression_threshold)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,6 +2,7 @@
 -- PostgreSQL Schema for Hybrid POS System
 
 -- Enable UUID extension
+-- The app supplies time-ordered UUIDv7 keys; the v4 defaults only cover manual inserts
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
 -- Products table
@@ -63,12 +64,30 @@ CREATE TABLE sync_queue (
     operation VARCHAR(20) NOT NULL,
     data JSONB NOT NULL,
     device_id VARCHAR(100),
+    job_id UUID,
     status VARCHAR(20) DEFAULT 'pending',
     retry_count INTEGER DEFAULT 0,
+    next_attempt_at TIMESTAMP,
+    last_error TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Sync items that ran out of retries, requeued through /api/sync/dead-letters/requeue
+CREATE TABLE sync_dead_letters (
+    id UUID PRIMARY KEY,
+    entity_type VARCHAR(50) NOT NULL,
+    entity_id UUID NOT NULL,
+    operation VARCHAR(20) NOT NULL,
+    data JSONB NOT NULL,
+    device_id VARCHAR(100),
+    job_id UUID,
+    retry_count INTEGER DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP,
+    failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Devices table
 CREATE TABLE devices (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -78,9 +97,46 @@ CREATE TABLE devices (
     last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_online BOOLEAN DEFAULT false,
     ip_address VARCHAR(50),
+    store_id VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Catalog version, bumped whenever products change (drives product list ETags)
+CREATE TABLE catalog_state (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_state (id, version) VALUES (1, 0);
+
+-- Sales rollups maintained alongside order completion, read by the dashboard
+CREATE TABLE sales_rollups (
+    bucket_date DATE NOT NULL,
+    bucket_hour SMALLINT NOT NULL,
+    device_id VARCHAR(100) NOT NULL DEFAULT '',
+    channel VARCHAR(10) NOT NULL,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    total_sales DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bucket_date, bucket_hour, device_id, channel)
+);
+
+-- Change log for cursor based delta sync, seq is allocated from change_log_state at commit
+CREATE TABLE change_log (
+    seq BIGINT PRIMARY KEY,
+    entity_type VARCHAR(50) NOT NULL,
+    entity_id UUID NOT NULL,
+    device_id VARCHAR(100),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE TABLE change_log_state (
+    id INTEGER PRIMARY KEY,
+    last_seq BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO change_log_state (id, last_seq) VALUES (1, 0);
+
 -- Indexes for performance
 CREATE INDEX idx_orders_created_at ON orders(created_at);
 CREATE INDEX idx_orders_device_id ON orders(device_id);
@@ -88,8 +144,15 @@ CREATE INDEX idx_orders_sync_status ON orders(sync_status);
 CREATE INDEX idx_order_items_order_id ON order_items(order_id);
 CREATE INDEX idx_sync_queue_status ON sync_queue(status);
 CREATE INDEX idx_sync_queue_created_at ON sync_queue(created_at);
+CREATE INDEX idx_sync_queue_status_created_at ON sync_queue(status, created_at);
+CREATE INDEX idx_sync_queue_status_updated_at ON sync_queue(status, updated_at);
+CREATE INDEX idx_sync_queue_status_next_attempt_at ON sync_queue(status, next_attempt_at);
+CREATE INDEX idx_sync_queue_job_id ON sync_queue(job_id);
+CREATE INDEX idx_sync_queue_device_status ON sync_queue(device_id, status);
+CREATE INDEX idx_sync_dead_letters_job_id ON sync_dead_letters(job_id);
 CREATE INDEX idx_products_sku ON products(sku);
 CREATE INDEX idx_products_category ON products(category);
+CREATE INDEX idx_change_log_created_at ON change_log(created_at);
 
 -- Function to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -0,0 +1,50 @@
+"""Loads POS sytem.py against a throwaway SQLite database for each test."""
+import sys
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def load_pos(monkeypatch, tmp_path):
+    """Import the app with extra environment variables, returns the module"""
+    def load(**env):
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'pos.db'}")
+        monkeypatch.setenv('BACKGROUND_LOCK_FILE', str(tmp_path / 'background.lock'))
+        monkeypatch.setenv('QR_RENDER_WORKERS', '0')
+        monkeypatch.delenv('VERCEL', raising=False)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        spec = spec_from_file_location("pos_system", ROOT / "POS sytem.py")
+        module = module_from_spec(spec)
+        monkeypatch.setitem(sys.modules, spec.name, module)
+        spec.loader.exec_module(module)
+        module.init_database()
+        # Drain explicitly instead of on the background wakeup
+        monkeypatch.setattr(module.sync_engine, 'schedule_drain', lambda: None)
+        return module
+    return load
+
+
+@pytest.fixture
+def pos(load_pos):
+    return load_pos()
+
+
+@pytest.fixture
+def client(pos):
+    return pos.app.test_client()
+
+
+def add_product(pos, **fields):
+    """Insert an online product and log the change, returns its id"""
+    with pos.app.app_context():
+        product = pos.Product(id=pos.new_id(), name=fields.pop('name', 'Tea'), price=fields.pop('price', 1.0),
+                              inventory_count=fields.pop('inventory_count', 20), online_sync=True, **fields)
+        pos.db.session.add(product)
+        pos.mark_catalog_changed(product.id)
+        pos.db.session.commit()
+        return str(product.id)
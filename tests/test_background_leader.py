@@ -0,0 +1,74 @@
+"""Background leader election over the lock file, and what followers do differently."""
+import pytest
+
+
+@pytest.fixture
+def leader(pos):
+    elected = pos.BackgroundLeader()
+    elected.active = True
+    yield elected
+    elected._release()
+
+
+@pytest.fixture
+def follower(pos):
+    candidate = pos.BackgroundLeader()
+    candidate.active = True
+    yield candidate
+    candidate._release()
+
+
+def test_only_one_process_leads(pos, leader, follower):
+    with pos.app.app_context():
+        assert leader.try_acquire() is True
+        assert follower.try_acquire() is False
+        # A leader keeps leading on later attempts
+        assert leader.try_acquire() is True
+        assert leader.stats()['is_leader'] is True
+        assert follower.stats()['is_leader'] is False
+
+
+def test_follower_takes_over_when_the_leader_exits(pos, leader, follower):
+    with pos.app.app_context():
+        leader.try_acquire()
+        leader._release()
+
+        assert follower.try_acquire() is True
+        assert leader.try_acquire() is False
+
+
+def test_follower_signal_wakes_the_leader(pos, leader, follower):
+    with pos.app.app_context():
+        leader.try_acquire()
+        follower.try_acquire()
+        assert leader.signalled() is False
+
+        follower.signal()
+
+        assert leader.signalled() is True
+        # Each signal is reported once
+        assert leader.signalled() is False
+
+
+def test_drain_is_left_to_the_leader(pos, monkeypatch):
+    drains = []
+    monkeypatch.setattr(pos.sync_engine, '_background_drain', lambda: drains.append(1))
+    monkeypatch.setattr(pos.background_leader, 'active', True)
+
+    pos.SyncEngine.schedule_drain(pos.sync_engine)
+
+    assert drains == []
+
+
+def test_follower_counts_pending_items_from_the_queue(pos, client, monkeypatch):
+    monkeypatch.setattr(pos.background_leader, 'active', True)
+    with pos.app.app_context():
+        pos.sync_engine.queue_for_sync('product', 'p-1', 'update', {'id': 'p-1'}, 'till-1')
+    assert client.post('/api/sync/status', json={'device_id': 'till-1'}).get_json()['pending_items'] == 1
+
+    # Drained by the leader in another process: this process's counters never see it
+    with pos.app.app_context():
+        pos.SyncQueue.query.update({'status': 'completed'})
+        pos.db.session.commit()
+
+    assert client.post('/api/sync/status', json={'device_id': 'till-1'}).get_json()['pending_items'] == 0
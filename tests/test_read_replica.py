@@ -0,0 +1,113 @@
+"""Read routing to the replica: lag fallback, stickiness and body handling."""
+import sqlite3
+
+import pytest
+
+from conftest import add_product
+
+
+@pytest.fixture
+def pos(load_pos, tmp_path):
+    module = load_pos(DATABASE_REPLICA_URL=f"sqlite:///{tmp_path / 'replica.db'}")
+    module.app.config['REPLICA_LAG_CHECK_SECONDS'] = 0
+    module.app.config['REPLICA_MAX_LAG_SECONDS'] = 0
+    module.replicate = lambda: replicate(tmp_path)
+    module.replicate()
+    return module
+
+
+def replicate(tmp_path):
+    """Bring the replica up to date with a copy of the primary"""
+    source = sqlite3.connect(tmp_path / 'pos.db')
+    target = sqlite3.connect(tmp_path / 'replica.db')
+    source.backup(target)
+    source.close()
+    target.close()
+
+
+def read_source(response):
+    return response.headers['X-Read-Source']
+
+
+def test_reads_go_to_a_caught_up_replica(pos, client):
+    add_product(pos)
+    pos.replicate()
+
+    response = client.get('/api/products')
+
+    assert read_source(response) == 'replica'
+    assert len(response.get_json()) == 1
+
+
+def test_lagging_replica_falls_back_to_primary(pos, client):
+    add_product(pos)
+
+    response = client.get('/api/products')
+
+    assert read_source(response) == 'primary'
+    assert len(response.get_json()) == 1
+    assert pos.replica_router.lag_seconds > 0
+
+
+def test_unreadable_replica_falls_back_to_primary(pos, client, tmp_path):
+    sqlite3.connect(tmp_path / 'replica.db').execute('DROP TABLE change_log_state')
+
+    response = client.get('/api/products')
+
+    assert read_source(response) == 'primary'
+    assert pos.replica_router.healthy is False
+
+
+def test_pull_on_the_replica_reads_its_body(pos, client):
+    for index in range(5):
+        add_product(pos, name=f"P{index}")
+    pos.replicate()
+
+    first = client.post('/api/sync/pull', json={'device_id': 'till-1', 'limit': 2})
+    cursor = first.get_json()['cursor']
+    second = client.post('/api/sync/pull', json={'device_id': 'till-1', 'limit': 2, 'cursor': cursor})
+
+    assert read_source(first) == 'replica'
+    assert first.get_json()['has_more'] is True
+    first_ids = [product['id'] for product in first.get_json()['updates']['products']]
+    second_ids = [product['id'] for product in second.get_json()['updates']['products']]
+    assert len(first_ids) == len(second_ids) == 2
+    assert not set(first_ids) & set(second_ids)
+
+
+def test_writer_stays_on_primary(pos, client):
+    product_id = add_product(pos)
+    pos.replicate()
+    response = client.post('/api/orders', json={
+        'device_id': 'till-1', 'payment_method': 'card',
+        'items': [{'product_id': product_id, 'quantity': 1, 'unit_price': 1.0}]})
+    assert response.status_code in (200, 201)
+    pos.replicate()
+
+    assert read_source(client.get('/api/products')) == 'primary'
+    other_client = pos.app.test_client()
+    assert read_source(other_client.get('/api/products')) == 'replica'
+    assert read_source(other_client.get('/api/products?device_id=till-1')) == 'primary'
+
+
+def test_streamed_push_makes_the_device_sticky(pos):
+    msgpack = pytest.importorskip('msgpack')
+    body = msgpack.packb({'device_id': 'till-2', 'updates': {'products': [{'id': pos.new_id(), 'name': 'X'}]}})
+
+    response = pos.app.test_client().post('/api/sync/push', data=body, content_type='application/msgpack')
+    pos.replicate()
+
+    assert response.status_code == 202
+    pull = pos.app.test_client().post('/api/sync/pull', json={'device_id': 'till-2'})
+    assert read_source(pull) == 'primary'
+
+
+def test_scan_retries_an_order_missing_from_the_replica(pos, client):
+    order_id = client.post('/api/orders', json={'device_id': 'till-1', 'items': []}).get_json()['order_id']
+
+    # The replica is behind, but lag is tolerated so the read starts there
+    pos.app.config['REPLICA_MAX_LAG_SECONDS'] = 3600
+    response = pos.app.test_client().post(f"/api/orders/{order_id}/scan", json={'scan_data': 'x'})
+
+    assert response.status_code == 200
+    assert read_source(response) == 'primary'
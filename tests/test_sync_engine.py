@@ -0,0 +1,47 @@
+"""Sync queue drain tests against a throwaway SQLite database."""
+from conftest import add_product
+
+
+def offline_order(pos, number, product_id):
+    return {
+        'id': pos.new_id(),
+        'order_number': number,
+        'total_amount': 1,
+        'status': 'completed',
+        'items': [{'product_id': product_id, 'quantity': 1, 'unit_price': 1, 'total_price': 1}]
+    }
+
+
+def test_inventory_row_queued_before_orders_is_applied_first(pos):
+    """An absolute inventory count queued ahead of offline orders must not overwrite their decrements"""
+    product_id = add_product(pos)
+    with pos.app.app_context():
+        engine = pos.sync_engine
+        engine.queue_for_sync('inventory', product_id, 'update', {'product_id': product_id, 'new_count': 8}, 'till-1')
+        for number in ('T-1', 'T-2'):
+            order = offline_order(pos, number, product_id)
+            engine.queue_for_sync('order', order['id'], 'create', order, 'till-1')
+
+        result = engine.process_sync_queue()
+
+        assert result['processed'] == 3
+        assert result['failed'] == 0
+        pos.db.session.expire_all()
+        assert pos.db.session.get(pos.Product, product_id).inventory_count == 6
+
+
+def test_failed_item_records_no_change(pos):
+    """Changes recorded inside a savepoint that rolls back must not reach change_log or the catalog version"""
+    pos.app.config['SYNC_MAX_RETRIES'] = 1
+    with pos.app.app_context():
+        version = pos.db.session.get(pos.CatalogState, 1).version
+        product_id = pos.new_id()
+        # No name: the insert fails when the item's savepoint is released
+        pos.sync_engine.queue_for_sync('product', product_id, 'create', {'id': product_id, 'price': 1.0}, 'till-1')
+
+        result = pos.sync_engine.process_sync_queue()
+
+        assert result['dead_lettered'] == 1
+        pos.db.session.expire_all()
+        assert pos.ChangeLog.query.count() == 0
+        assert pos.db.session.get(pos.CatalogState, 1).version == version
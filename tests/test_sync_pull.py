@@ -0,0 +1,70 @@
+"""Cursor paging for /api/sync/pull."""
+import pytest
+
+from conftest import add_product
+
+
+def pull_all(client, **bounds):
+    """Follow cursors to the end, returns (product ids per page, last response)"""
+    pages, body = [], {'device_id': 'till-1', **bounds}
+    while True:
+        response = client.post('/api/sync/pull', json=body)
+        assert response.status_code == 200
+        data = response.get_json()
+        pages.append([product['id'] for product in data['updates']['products']])
+        if not data['has_more']:
+            return pages, data
+        body['cursor'] = data['cursor']
+
+
+def test_limit_pages_through_every_change_once(pos, client):
+    product_ids = [add_product(pos, name=f"P{index}") for index in range(5)]
+
+    pages, last = pull_all(client, limit=2)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sorted(sum(pages, [])) == sorted(product_ids)
+    # Nothing new: the final cursor returns an empty page
+    response = client.post('/api/sync/pull', json={'device_id': 'till-1', 'cursor': last['cursor']})
+    assert response.get_json()['updates']['products'] == []
+
+
+def test_max_bytes_still_returns_one_row_per_page(pos, client):
+    for index in range(3):
+        add_product(pos, name=f"P{index}")
+
+    pages, _ = pull_all(client, max_bytes=1)
+
+    assert [len(page) for page in pages] == [1, 1, 1]
+
+
+def test_cursor_only_returns_later_changes(pos, client):
+    add_product(pos)
+    cursor = client.post('/api/sync/pull', json={'device_id': 'till-1'}).get_json()['cursor']
+    later = add_product(pos, name='Coffee')
+
+    data = client.post('/api/sync/pull', json={'device_id': 'till-1', 'cursor': cursor}).get_json()
+
+    assert [product['id'] for product in data['updates']['products']] == [later]
+
+
+def test_negative_limit_is_clamped_to_one(pos, client):
+    for index in range(2):
+        add_product(pos, name=f"P{index}")
+
+    data = client.post('/api/sync/pull', json={'device_id': 'till-1', 'limit': -1}).get_json()
+
+    assert len(data['updates']['products']) == 1
+    assert data['has_more'] is True
+
+
+@pytest.mark.parametrize('body', [
+    {'limit': 'abc'},
+    {'max_bytes': [1]},
+    {'cursor': 'not-a-cursor'},
+])
+def test_bad_page_bounds_are_rejected(client, body):
+    response = client.post('/api/sync/pull', json={'device_id': 'till-1', **body})
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
@@ -0,0 +1,78 @@
+"""Retry backoff and dead-lettering of sync items."""
+from datetime import datetime, timedelta
+
+
+def queue_bad_product(pos):
+    """A product create without a name, which fails every time it is applied"""
+    product_id = pos.new_id()
+    pos.sync_engine.queue_for_sync('product', product_id, 'create', {'id': product_id, 'price': 1.0}, 'till-1')
+    return pos.SyncQueue.query.filter_by(entity_id=product_id).one().id
+
+
+def make_due(pos, item_id):
+    pos.db.session.get(pos.SyncQueue, item_id).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    pos.db.session.commit()
+
+
+def test_failed_item_is_retried_after_backoff(pos):
+    pos.app.config['SYNC_RETRY_BASE_SECONDS'] = 30
+    with pos.app.app_context():
+        item_id = queue_bad_product(pos)
+        before = datetime.utcnow()
+
+        result = pos.sync_engine.process_sync_queue()
+
+        item = pos.db.session.get(pos.SyncQueue, item_id)
+        assert result['failed'] == 1
+        assert item.status == 'retry'
+        assert item.retry_count == 1
+        assert item.last_error
+        # Half the base delay plus jitter up to the other half
+        assert before + timedelta(seconds=15) <= item.next_attempt_at <= datetime.utcnow() + timedelta(seconds=30)
+
+        # Not due yet: the next drain leaves it alone
+        assert pos.sync_engine.process_sync_queue()['failed'] == 0
+
+        make_due(pos, item_id)
+        assert pos.sync_engine.process_sync_queue()['failed'] == 1
+        assert pos.db.session.get(pos.SyncQueue, item_id).retry_count == 2
+
+
+def test_retry_delay_is_capped(pos):
+    pos.app.config['SYNC_RETRY_MAX_SECONDS'] = 60
+    with pos.app.app_context():
+        delays = [pos.sync_engine.retry_delay(attempt) for attempt in range(1, 30)]
+    assert all(0 < delay <= 60 for delay in delays)
+    assert max(delays) >= 30
+
+
+def test_item_out_of_retries_moves_to_dead_letters_and_back(pos, client):
+    pos.app.config['SYNC_MAX_RETRIES'] = 2
+    with pos.app.app_context():
+        item_id = queue_bad_product(pos)
+        pos.sync_engine.process_sync_queue()
+        make_due(pos, item_id)
+
+        result = pos.sync_engine.process_sync_queue()
+
+        assert result['dead_lettered'] == 1
+        assert pos.db.session.get(pos.SyncQueue, item_id) is None
+        dead_letter = pos.db.session.get(pos.SyncDeadLetter, item_id)
+        assert dead_letter.retry_count == 2
+    assert client.post('/api/sync/status', json={'device_id': 'till-1'}).get_json()['pending_items'] == 0
+    listed = client.get('/api/sync/dead-letters?device_id=till-1').get_json()
+    assert [item['id'] for item in listed['items']] == [item_id]
+
+    response = client.post('/api/sync/dead-letters/requeue', json={'ids': [item_id]})
+
+    assert response.get_json()['requeued'] == 1
+    with pos.app.app_context():
+        item = pos.db.session.get(pos.SyncQueue, item_id)
+        assert (item.status, item.retry_count) == ('pending', 0)
+        assert pos.db.session.get(pos.SyncDeadLetter, item_id) is None
+    assert client.post('/api/sync/status', json={'device_id': 'till-1'}).get_json()['pending_items'] == 1
+
+
+def test_requeue_needs_a_filter(client):
+    assert client.post('/api/sync/dead-letters/requeue', json={}).status_code == 400
+    assert client.post('/api/sync/dead-letters/requeue', json={'ids': ['nope']}).status_code == 400
@@ -0,0 +1,131 @@
+"""Sync push and pull wire formats: compression, MessagePack, NDJSON and their 4xx paths."""
+import gzip
+import json
+
+import pytest
+
+from conftest import add_product
+
+
+def order(pos, number):
+    return {'id': pos.new_id(), 'order_number': number, 'total_amount': 1, 'items': []}
+
+
+def push_body(pos, count=2):
+    return {'device_id': 'till-1', 'updates': {'orders': [order(pos, f"N{index}") for index in range(count)]}}
+
+
+def queued(pos):
+    with pos.app.app_context():
+        return pos.SyncQueue.query.filter_by(device_id='till-1').count()
+
+
+def test_gzip_json_push(pos, client):
+    response = client.post('/api/sync/push', data=gzip.compress(json.dumps(push_body(pos)).encode()),
+                           content_type='application/json', headers={'Content-Encoding': 'gzip'})
+
+    assert response.status_code == 202
+    assert queued(pos) == 2
+
+
+def test_zstd_push_with_any_header_case(pos, client):
+    zstandard = pytest.importorskip('zstandard')
+    body = zstandard.ZstdCompressor().compress(json.dumps(push_body(pos)).encode())
+
+    response = client.post('/api/sync/push', data=body, content_type='application/json',
+                           headers={'Content-Encoding': ' ZSTD'})
+
+    assert response.status_code == 202
+    assert queued(pos) == 2
+
+
+def test_msgpack_push(pos, client):
+    msgpack = pytest.importorskip('msgpack')
+
+    response = client.post('/api/sync/push', data=msgpack.packb(push_body(pos)), content_type='application/msgpack')
+
+    assert response.status_code == 202
+    assert queued(pos) == 2
+
+
+def test_ndjson_stream_push(pos, client):
+    lines = [{'device_id': 'till-1'}] + [{'order': order(pos, f"N{index}")} for index in range(3)]
+    body = '\n'.join(json.dumps(line) for line in lines) + '\n'
+
+    response = client.post('/api/sync/push', data=body, content_type='application/x-ndjson')
+
+    assert response.status_code == 202
+    assert queued(pos) == 3
+
+
+def test_bad_stream_record_queues_nothing(pos, client):
+    lines = [{'device_id': 'till-1'}, {'order': order(pos, 'N1')}, {'order': {'id': 'nope'}}]
+    body = '\n'.join(json.dumps(line) for line in lines)
+
+    response = client.post('/api/sync/push', data=body, content_type='application/x-ndjson')
+
+    assert response.status_code == 400
+    assert response.get_json()['errors']
+    assert queued(pos) == 0
+
+
+@pytest.mark.parametrize('data, content_type', [
+    (b'[1, 2]', 'application/json'),
+    (b'5', 'application/json'),
+    (b'{"device_id": ', 'application/json'),
+    (b'"x"\n', 'application/x-ndjson'),
+])
+def test_malformed_push_body_is_400(client, data, content_type):
+    response = client.post('/api/sync/push', data=data, content_type=content_type)
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_msgpack_list_body_is_400(client):
+    msgpack = pytest.importorskip('msgpack')
+
+    response = client.post('/api/sync/push', data=msgpack.packb([1]), content_type='application/msgpack')
+
+    assert response.status_code == 400
+
+
+def test_corrupt_gzip_is_400(client):
+    response = client.post('/api/sync/push', data=b'not gzip', content_type='application/json',
+                           headers={'Content-Encoding': 'gzip'})
+
+    assert response.status_code == 400
+
+
+def test_unsupported_encoding_is_415(client):
+    response = client.post('/api/sync/push', data=b'{}', content_type='application/json',
+                           headers={'Content-Encoding': 'br'})
+
+    assert response.status_code == 415
+
+
+def test_body_over_the_limit_is_413(pos, client):
+    pos.app.config['SYNC_MAX_BODY_BYTES'] = 1024
+    body = gzip.compress(json.dumps(push_body(pos, count=50)).encode())
+    assert len(body) < 1024
+
+    response = client.post('/api/sync/push', data=body, content_type='application/json',
+                           headers={'Content-Encoding': 'gzip'})
+
+    assert response.status_code == 413
+    assert queued(pos) == 0
+
+
+def test_pull_answers_in_msgpack_and_compresses(pos, client):
+    msgpack = pytest.importorskip('msgpack')
+    pos.app.config['SYNC_COMPRESS_MIN_BYTES'] = 1
+    add_product(pos)
+
+    response = client.post('/api/sync/pull', json={'device_id': 'till-1'},
+                           headers={'Accept': 'application/msgpack', 'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/msgpack'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = msgpack.unpackb(gzip.decompress(response.data), raw=False)
+    assert len(data['updates']['products']) == 1